@@ -2,17 +2,32 @@ from discord.ext import commands
 from .utils.chat_formatting import box
 from .utils.dataIO import dataIO
 from .utils import checks
+from .utils.alias_trie import AliasChain, AliasCycle, AliasTrie
 from __main__ import user_allowed, send_cmd_help
-from copy import deepcopy
+from copy import copy, deepcopy
 import os
+import time
 import discord
 
+BENCHMARK_MAX = 1000  # It runs on the event loop
+
+
+def clone_message(message, content):
+    """Returns a shallow copy of message with a different content
+
+    Author, server, channel and the other references are shared with
+    the original instead of being deep copied"""
+    new_message = copy(message)
+    new_message.content = content
+    return new_message
+
 
 class Alias:
     def __init__(self, bot):
         self.bot = bot
         self.file_path = "data/alias/aliases.json"
         self.aliases = dataIO.load_json(self.file_path)
+        self._tries = {}  # sid: AliasTrie
         self.remove_old()
 
     @commands.group(pass_context=True, no_pm=True)
@@ -26,13 +41,16 @@ class Alias:
     async def _add_alias(self, ctx, command, *, to_execute):
         """Add an alias for a command
 
-           Example: !alias add test flip @Twentysix"""
+           Aliases can be multiple words (use quotes), point to other
+           aliases and use {0}, {1}... or {args} for their arguments.
+
+           Example: !alias add test flip @Twentysix
+                    !alias add "coin toss" flip {0}"""
         server = ctx.message.server
-        command = command.lower()
-        if len(command.split(" ")) != 1:
-            await self.bot.say("I can't safely do multi-word aliases because"
-                               " of the fact that I allow arguments to"
-                               " aliases. It sucks, I know, deal with it.")
+        command = self.normalize(command)
+        if command.split(" ")[0] in self.bot.commands:
+            await self.bot.say("Cannot add '{}' because it's a real bot "
+                               "command.".format(command))
             return
         if self.part_of_existing_command(command, server.id):
             await self.bot.say('I can\'t safely add an alias that starts with '
@@ -41,53 +59,58 @@ class Alias:
         prefix = self.get_prefix(server, to_execute)
         if prefix is not None:
             to_execute = to_execute[len(prefix):]
-        if server.id not in self.aliases:
-            self.aliases[server.id] = {}
-        if command not in self.bot.commands:
-            self.aliases[server.id][command] = to_execute
-            dataIO.save_json(self.file_path, self.aliases)
-            await self.bot.say("Alias '{}' added.".format(command))
-        else:
-            await self.bot.say("Cannot add '{}' because it's a real bot "
-                               "command.".format(command))
+        server_aliases = dict(self.aliases.get(server.id, {}))
+        server_aliases[command] = to_execute
+        try:
+            trie = AliasTrie(server_aliases, list(self.bot.commands))
+        except AliasCycle as e:
+            await self.bot.say("Cannot add '{}' because it would make alias "
+                               "'{}' call itself.".format(command, e))
+            return
+        self.aliases[server.id] = server_aliases
+        self._tries[server.id] = trie
+        dataIO.save_json(self.file_path, self.aliases)
+        await self.bot.say("Alias '{}' added.".format(command))
 
     @alias.command(name="help", pass_context=True, no_pm=True)
-    async def _help_alias(self, ctx, command):
+    async def _help_alias(self, ctx, *, command):
         """Tries to execute help for the base command of the alias"""
         server = ctx.message.server
-        if server.id in self.aliases:
-            server_aliases = self.aliases[server.id]
-            if command in server_aliases:
-                help_cmd = server_aliases[command].split(" ")[0]
-                new_content = self.bot.settings.get_prefixes(server)[0]
-                new_content += "help "
-                new_content += help_cmd[len(self.get_prefix(server,
-                                        help_cmd)):]
-                message = ctx.message
-                message.content = new_content
-                await self.bot.process_commands(message)
-            else:
-                await self.bot.say("That alias doesn't exist.")
+        command = self.normalize(command)
+        trie = self.get_trie(server)
+        if trie is not None and command in trie.flattened:
+            help_cmd = trie.flattened[command].text.split(" ")[0]
+            new_content = self.bot.settings.get_prefixes(server)[0]
+            new_content += "help " + help_cmd
+            message = clone_message(ctx.message, new_content)
+            await self.bot.process_commands(message)
+        else:
+            await self.bot.say("That alias doesn't exist.")
 
     @alias.command(name="show", pass_context=True, no_pm=True)
-    async def _show_alias(self, ctx, command):
+    async def _show_alias(self, ctx, *, command):
         """Shows what command the alias executes."""
         server = ctx.message.server
-        if server.id in self.aliases:
-            server_aliases = self.aliases[server.id]
-            if command in server_aliases:
-                await self.bot.say(box(server_aliases[command]))
-            else:
-                await self.bot.say("That alias doesn't exist.")
+        command = self.normalize(command)
+        trie = self.get_trie(server)
+        if trie is not None and command in trie.flattened:
+            text = self.aliases[server.id][command]
+            expanded = trie.flattened[command].text
+            if expanded != text:
+                text += "\n-> " + expanded
+            await self.bot.say(box(text))
+        else:
+            await self.bot.say("That alias doesn't exist.")
 
     @alias.command(name="del", pass_context=True, no_pm=True)
     @checks.mod_or_permissions(manage_server=True)
-    async def _del_alias(self, ctx, command):
+    async def _del_alias(self, ctx, *, command):
         """Deletes an alias"""
-        command = command.lower()
+        command = self.normalize(command)
         server = ctx.message.server
         if server.id in self.aliases:
             self.aliases[server.id].pop(command, None)
+            self._tries.pop(server.id, None)
             dataIO.save_json(self.file_path, self.aliases)
         await self.bot.say("Alias '{}' deleted.".format(command))
 
@@ -110,32 +133,91 @@ class Alias:
             else:
                 await self.bot.say("There are no aliases on this server.")
 
+    @alias.command(name="benchmark", pass_context=True, hidden=True,
+                   no_pm=True)
+    @checks.is_owner()
+    async def _benchmark_alias(self, ctx, iterations: int, *, alias):
+        """Times alias dispatch, shallow clone vs deepcopy of the message
+
+        Command processing itself is not included"""
+        message = ctx.message
+        server = message.server
+        iterations = max(1, min(iterations, BENCHMARK_MAX))
+        content = self.bot.settings.get_prefixes(server)[0] + alias
+        if self.resolve_alias(server, content) is None:
+            await self.bot.say("That alias doesn't exist.")
+            return
+
+        start = time.perf_counter()
+        for i in range(iterations):
+            clone_message(message, self.resolve_alias(server, content))
+        clone_time = (time.perf_counter() - start) / iterations
+
+        start = time.perf_counter()
+        for i in range(iterations):
+            new_message = deepcopy(message)
+            new_message.content = self.resolve_alias(server, content)
+        deepcopy_time = (time.perf_counter() - start) / iterations
+
+        await self.bot.say(box("Alias dispatch, {} iterations\n\n"
+                               "Clone:    {:>10.1f} us\n"
+                               "Deepcopy: {:>10.1f} us"
+                               "".format(iterations, clone_time * 10**6,
+                                         deepcopy_time * 10**6)))
+
     async def on_message(self, message):
         if len(message.content) < 2 or message.channel.is_private:
             return
 
-        msg = message.content
-        server = message.server
-        prefix = self.get_prefix(server, msg)
+        new_content = self.resolve_alias(message.server, message.content)
 
+        if new_content is not None and user_allowed(message):
+            new_message = clone_message(message, new_content)
+            await self.bot.process_commands(new_message)
+
+    def resolve_alias(self, server, content):
+        """Returns what the message's content expands to, or None if
+        it doesn't start with an alias"""
+        trie = self.get_trie(server)
+        if trie is None:
+            return None
+        prefix = self.get_prefix(server, content)
         if not prefix:
-            return
+            return None
+        tokens = content[len(prefix):].split(" ")
+        length, chain = trie.longest_match(tokens)
+        if not isinstance(chain, AliasChain):
+            return None
+        return prefix + chain.render(tokens[length:])
 
-        if server.id in self.aliases and user_allowed(message):
-            alias = self.first_word(msg[len(prefix):]).lower()
-            if alias in self.aliases[server.id]:
-                new_command = self.aliases[server.id][alias]
-                args = message.content[len(prefix + alias):]
-                new_message = deepcopy(message)
-                new_message.content = prefix + new_command + args
-                await self.bot.process_commands(new_message)
+    def get_trie(self, server):
+        """Returns the server's AliasTrie, None if it has no aliases
+
+        Tries are rebuilt lazily after aliases or commands change"""
+        trie = self._tries.get(server.id)
+        if trie is not None and \
+                trie.command_count == len(self.bot.commands):
+            return trie
+        server_aliases = self.aliases.get(server.id)
+        if not server_aliases:
+            return None
+        try:
+            trie = AliasTrie(server_aliases, list(self.bot.commands))
+        except AliasCycle:
+            # Only possible with a hand edited aliases.json
+            trie = AliasTrie({}, list(self.bot.commands))
+        self._tries[server.id] = trie
+        return trie
 
     def part_of_existing_command(self, alias, server):
         '''Command or alias'''
-        for command in self.bot.commands:
-            if alias.lower() == command.lower():
-                return True
-        return False
+        alias = alias.lower()
+        if alias in self.bot.commands:
+            return True
+        return alias in {command.lower() for command in self.bot.commands}
+
+    def normalize(self, alias):
+        return " ".join(alias.lower().split())
 
     def remove_old(self):
         for sid in self.aliases:
@@ -146,9 +228,6 @@ class Alias:
                 if aliasname != lower:
                     to_delete.append(aliasname)
                     to_add.append((lower, alias))
-                if aliasname != self.first_word(aliasname):
-                    to_delete.append(aliasname)
-                    continue
                 server = discord.Object(id=sid)
                 prefix = self.get_prefix(server, alias)
                 if prefix is not None:
@@ -159,9 +238,6 @@ class Alias:
                 self.aliases[sid][alias] = command
         dataIO.save_json(self.file_path, self.aliases)
 
-    def first_word(self, msg):
-        return msg.split(" ")[0]
-
     def get_prefix(self, server, msg):
         prefixes = self.bot.settings.get_prefixes(server)
         for p in prefixes:
@@ -1,36 +1,39 @@
 import discord
 from discord.ext import commands
-import threading
 import os
+import threading
+import itertools
 from random import shuffle, choice
 from cogs.utils.dataIO import dataIO
 from cogs.utils import checks
-from cogs.utils.chat_formatting import pagify, escape
+from cogs.utils.chat_formatting import pagify, escape, box
+from cogs.utils.ytdl_jobs import (Downloader, CacheStore, YoutubeDLPool,
+                                  Song, MaximumLength, youtube_dl,
+                                  youtube_dl_options, make_process_pool,
+                                  DOWNLOAD_WORKERS)
 from urllib.parse import urlparse
 from __main__ import send_cmd_help, settings
 from json import JSONDecodeError
 import re
 import logging
 import collections
-import copy
 import asyncio
 import math
 import time
 import inspect
 import subprocess
 import urllib.parse
+import json
+import bisect
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 __author__ = "tekulvw"
 __version__ = "0.1.1"
 
 log = logging.getLogger("red.audio")
 
-try:
-    import youtube_dl
-except:
-    youtube_dl = None
-
 try:
     if not discord.opus.is_loaded():
         discord.opus.load_opus('libopus-0.dll')
@@ -41,28 +44,28 @@ except:  # Missing opus
 else:
     opus = True
 
-youtube_dl_options = {
-    'source_address': '0.0.0.0',
-    'format': 'bestaudio/best',
-    'extractaudio': True,
-    'audioformat': "mp3",
-    'nocheckcertificate': True,
-    'ignoreerrors': False,
-    'quiet': True,
-    'no_warnings': True,
-    'outtmpl': "data/audio/cache/%(id)s",
-    'default_search': 'auto',
-    'encoding': 'utf-8'
-}
-
-
-class MaximumLength(Exception):
-    def __init__(self, m):
-        self.message = m
+PLAYLIST_PATH = "data/audio/playlists"
+PLAYLIST_INDEX = "data/audio/playlists/index.json"
+PLAYLIST_BATCH = 2
+LOCAL_INDEX = "data/audio/localtracks.json"
+LOCAL_SCAN = 300
+LOCAL_RESULTS = 15
+PLAYER_PRELOAD = 5
+TELEMETRY_SAMPLES = 200
+TELEMETRY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TELEMETRY_PATH = "data/audio/telemetry.json"
+QUEUE_PAGE = 10
+QUEUE_EDIT_INTERVAL = 1
+METADATA_PATH = "data/audio/metadata.json"
+METADATA_TTL = 6 * 60 * 60
+METADATA_MAX = 5000
+METADATA_FLUSH = 60
+METADATA_FIELDS = ("id", "title", "webpage_url", "duration", "creator",
+                   "uploader", "view_count", "extractor", "thumbnail",
+                   "start_time", "end_time")
+YOUTUBE_ID = re.compile(r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|embed/|v/)|"
+                        r"youtu\.be/)([\w-]{11})")
 
-    def __str__(self):
-        return self.message
-    
 
 class YouTubeDlError(Exception):
     def __init__(self, m):
@@ -120,14 +123,14 @@ class deque(collections.deque):
         super().__init__(*args, **kwargs)
 
     def peek(self):
-        ret = self.pop()
-        self.append(ret)
-        return copy.deepcopy(ret)
+        return self[-1]
 
     def peekleft(self):
-        ret = self.popleft()
-        self.appendleft(ret)
-        return copy.deepcopy(ret)
+        return self[0]
+
+PreparedSong = collections.namedtuple(
+    "PreparedSong", "queued_song queue_key song player")
+
 
 class QueueKey(Enum):
 	REPEAT = 1
@@ -138,17 +141,6 @@ class QueueKey(Enum):
 	NOW_PLAYING = 6
 	NOW_PLAYING_CHANNEL = 7
 
-class Song:
-    def __init__(self, **kwargs):
-        self.__dict__ = kwargs
-        self.title = kwargs.pop('title', None)
-        self.id = kwargs.pop('id', None)
-        self.url = kwargs.pop('url', None)
-        self.webpage_url = kwargs.pop('webpage_url', "")
-        self.duration = kwargs.pop('duration', 60)
-        self.start_time = kwargs.pop('start_time', None)
-        self.end_time = kwargs.pop('end_time', None)
-
 class QueuedSong:
     def __init__(self, url, channel):
         self.url = url
@@ -231,6 +223,10 @@ class Playlist:
 
     def save(self):
         dataIO.save_json(self.path, self.to_json())
+        if self.main_class is not None:
+            scope = "" if self.main_class._playlist_exists_global(self.name) \
+                else self.sid
+            self.main_class.playlist_index.update(scope, self.name)
 
     @property
     def sid(self):
@@ -242,64 +238,514 @@ class Playlist:
             return None
 
 
-class Downloader(threading.Thread):
-    def __init__(self, url, max_duration=None, download=False,
-                 cache_path="data/audio/cache", *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.url = url
-        self.max_duration = max_duration
-        self.done = threading.Event()
-        self.song = None
-        self._download = download
-        self.hit_max_length = threading.Event()
-        self._yt = None
-        self.error = None
-
-    def run(self):
+class PlaylistIndex:
+    """Knows which playlists exist per server, their track counts and
+    whatever has been resolved about their tracks, so listing doesn't
+    rescan folders and starting doesn't reparse unchanged files
+
+    Global playlists live under the "" scope, server ones under their id."""
+
+    def __init__(self, root=PLAYLIST_PATH, path=PLAYLIST_INDEX):
+        self.root = root
+        self.path = path
+        self.scopes = {}  # scope: {name: {"count", "mtime", "tracks"}}
+        self._loaded = {}  # file path: (mtime, data)
+        if dataIO.is_valid_json(path):
+            self.scopes = dataIO.load_json(path)
+        self.refresh()
+
+    def file(self, scope, name):
+        return os.path.join(self.root, scope, name + ".txt")
+
+    def refresh(self):
+        """Syncs the index with the playlist folders, only rereading
+        files whose mtime changed"""
+        found = {"": self._scan_folder(self.root)}
+        for entry in os.scandir(self.root):
+            if entry.is_dir():
+                found[entry.name] = self._scan_folder(entry.path)
+
+        changed = set(self.scopes) != set(found)
+        for scope, names in found.items():
+            known = self.scopes.setdefault(scope, {})
+            for name in set(known) - set(names):
+                del known[name]
+                changed = True
+            for name, mtime in names.items():
+                if name not in known or known[name]["mtime"] != mtime:
+                    self.update(scope, name, save=False)
+                    changed = True
+        for scope in set(self.scopes) - set(found):
+            del self.scopes[scope]
+        if changed:
+            self.save()
+
+    @staticmethod
+    def _scan_folder(path):
+        return {entry.name[:-4]: entry.stat().st_mtime
+                for entry in os.scandir(path)
+                if entry.is_file() and entry.name.endswith(".txt")}
+
+    def save(self):
+        dataIO.save_json(self.path, self.scopes)
+
+    def names(self, sid):
+        return set(self.scopes.get("", {})) | set(self.scopes.get(sid, {}))
+
+    def get(self, scope, name):
+        entry = self.scopes.get(scope, {}).get(name)
+        if entry is None and os.path.isfile(self.file(scope, name)):
+            entry = self.update(scope, name)  # Added behind our back
+        return entry
+
+    def read(self, scope, name):
+        """Playlist file contents, reparsed only when the file changed"""
+        path = self.file(scope, name)
+        mtime = os.path.getmtime(path)
+        cached = self._loaded.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, dataIO.load_json(path))
+            self._loaded[path] = cached
+        data = dict(cached[1])
+        data["playlist"] = list(data.get("playlist") or [])
+        return data
+
+    def update(self, scope, name, save=True):
+        """Reindexes one playlist after it was written"""
         try:
-            self.get_info()
-            if self._download:
-                self.download()
-        except youtube_dl.utils.DownloadError as e:
-            self.error = str(e)
-        except MaximumLength:
-            self.hit_max_length.set()
-        except OSError as e:
-            log.warning("An operating system error occurred while downloading URL '{}':\n'{}'".format(self.url, str(e)))
-        self.done.set()
-
-    def download(self):
-        self.duration_check()
-
-        if not os.path.isfile('data/audio/cache' + self.song.id):
-            video = self._yt.extract_info(self.url)
-            self.song = Song(**video)
-
-    def duration_check(self):
-        log.debug("duration {} for songid {}".format(self.song.duration,
-                                                     self.song.id))
-        if self.max_duration and self.song.duration > self.max_duration:
-            log.debug("songid {} too long".format(self.song.id))
-            raise MaximumLength("songid {} has duration {} > {}".format(
-                self.song.id, self.song.duration, self.max_duration))
-
-    def get_info(self):
-        if self._yt is None:
-            self._yt = youtube_dl.YoutubeDL(youtube_dl_options)
-        if "[SEARCH:]" not in self.url:
-            video = self._yt.extract_info(self.url, download=False,
-                                          process=False)
+            data = self.read(scope, name)
+        except (OSError, JSONDecodeError):
+            return self.remove(scope, name, save)
+        known = self.scopes.setdefault(scope, {}).get(name, {})
+        urls = set(data["playlist"])
+        tracks = {url: info for url, info in known.get("tracks", {}).items()
+                  if url in urls}
+        entry = {"count": len(data["playlist"]),
+                 "mtime": os.path.getmtime(self.file(scope, name)),
+                 "tracks": tracks}
+        self.scopes[scope][name] = entry
+        if save:
+            self.save()
+        return entry
+
+    def remove(self, scope, name, save=True):
+        self.scopes.get(scope, {}).pop(name, None)
+        self._loaded.pop(self.file(scope, name), None)
+        if save:
+            self.save()
+
+    def set_track(self, scope, name, url, song):
+        entry = self.scopes.get(scope, {}).get(name)
+        if entry is not None:
+            entry["tracks"][url] = {"title": song.title,
+                                    "duration": song.duration}
+
+
+class LocalLibrary:
+    """Persistent index of data/audio/localtracks
+
+    Every folder is a local playlist. scan() stats the whole tree but only
+    runs ffprobe on files whose mtime or size changed, and is meant to run
+    in an executor; apply() swaps the result in on the event loop and
+    rebuilds the inverted index used by search()."""
+
+    def __init__(self, root, path=LOCAL_INDEX):
+        self.root = root
+        self.path = path
+        self.tracks = {}  # "folder/file": {mtime, size, duration, tags}
+        self.folders = {}  # folder: sorted file names
+        self.words = {}  # token: track keys
+        self.vocab = []  # sorted tokens, for prefix lookups
+        self.ready = False
+        self.probe = True
+        self.updated = 0  # Wall clock time the index reflects the disk at
+        if dataIO.is_valid_json(path):
+            self.tracks = dataIO.load_json(path)
+            self._rebuild()
+            self.ready = True
+            self.updated = os.path.getmtime(path)
+
+    def scan(self):
+        tracks = {}
+        for folder in os.scandir(self.root):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if not entry.is_file():
+                    continue
+                key = folder.name + "/" + entry.name
+                stat = entry.stat()
+                known = self.tracks.get(key)
+                if known and known["mtime"] == stat.st_mtime and \
+                        known["size"] == stat.st_size:
+                    tracks[key] = known
+                    continue
+                track = {"mtime": stat.st_mtime, "size": stat.st_size}
+                track.update(self._ffprobe(entry.path))
+                tracks[key] = track
+        return tracks
+
+    def _ffprobe(self, path):
+        if not self.probe:
+            return {}
+        args = ["ffprobe", "-v", "quiet", "-print_format", "json",
+                "-show_format", path]
+        try:
+            output = subprocess.check_output(args, stdin=subprocess.DEVNULL)
+        except FileNotFoundError:
+            log.warning("ffprobe not found, indexing local tracks without"
+                        " tags")
+            self.probe = False
+            return {}
+        except (OSError, subprocess.CalledProcessError):
+            return {}
+        try:
+            fmt = json.loads(output.decode("utf-8", "replace"))["format"]
+        except (ValueError, KeyError):
+            return {}
+        tags = {k.lower(): v for k, v in fmt.get("tags", {}).items()}
+        try:
+            duration = int(float(fmt["duration"]))
+        except (KeyError, ValueError):
+            duration = None
+        return {"duration": duration, "title": tags.get("title"),
+                "artist": tags.get("artist"), "album": tags.get("album")}
+
+    def apply(self, tracks, started):
+        """Installs a scan result, returns whether anything changed.
+        started is the time.time() the scan began at"""
+        changed = tracks != self.tracks
+        self.tracks = tracks
+        self.ready = True
+        self.updated = started
+        if changed:
+            self._rebuild()
+            dataIO.save_json(self.path, tracks)
+        return changed
+
+    def _rebuild(self):
+        folders = collections.defaultdict(list)
+        words = collections.defaultdict(set)
+        for key, track in self.tracks.items():
+            folder, filename = key.split("/", 1)
+            folders[folder].append(filename)
+            text = " ".join(str(track.get(field) or "")
+                            for field in ("title", "artist", "album"))
+            for word in self.tokenize(" ".join((text, folder, filename))):
+                words[word].add(key)
+        self.folders = {folder: sorted(files)
+                        for folder, files in folders.items()}
+        self.words = dict(words)
+        self.vocab = sorted(words)
+
+    def covers(self, folder=None):
+        """Whether the index is current for folder, or for the list of
+        folders if folder is None. Adding or removing a file bumps its
+        directory's mtime, so a newer one means the index is stale"""
+        if not self.ready:
+            return False
+        if folder is None:
+            path = self.root
+        elif folder in self.folders:
+            path = os.path.join(self.root, folder)
         else:
-            self.url = self.url[9:]
-            yt_id = self._yt.extract_info(
-                self.url, download=False)["entries"][0]["id"]
-            # Should handle errors here ^
-            self.url = "https://youtube.com/watch?v={}".format(yt_id)
-            video = self._yt.extract_info(self.url, download=False,
-                                          process=False)
+            return False
+        try:
+            return os.path.getmtime(path) <= self.updated
+        except OSError:
+            return False
+
+    @staticmethod
+    def tokenize(text):
+        return re.findall(r"[^\W_]+", text.lower())
+
+    def search(self, terms):
+        """Tracks matching every term, a term matches words it prefixes"""
+        result = None
+        for term in self.tokenize(terms):
+            keys = set()
+            i = bisect.bisect_left(self.vocab, term)
+            while i < len(self.vocab) and self.vocab[i].startswith(term):
+                keys |= self.words[self.vocab[i]]
+                i += 1
+            result = keys if result is None else result & keys
+            if not result:
+                return []
+        return sorted(result or [])
+
+
+class RollingHistogram:
+    """The last TELEMETRY_SAMPLES timings of one stage, in seconds"""
+
+    def __init__(self, size=TELEMETRY_SAMPLES):
+        self.samples = collections.deque(maxlen=size)
+
+    def add(self, value):
+        self.samples.append(value)
+
+    def percentile(self, p):
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * p), len(ordered) - 1)]
+
+    def to_json(self):
+        buckets = collections.OrderedDict(
+            ("<={}".format(bound), 0) for bound in TELEMETRY_BUCKETS)
+        buckets[">{}".format(TELEMETRY_BUCKETS[-1])] = 0
+        for value in self.samples:
+            i = bisect.bisect_left(TELEMETRY_BUCKETS, value)
+            buckets[list(buckets)[i]] += 1
+        return {"count": len(self.samples),
+                "p50": self.percentile(0.5),
+                "p95": self.percentile(0.95),
+                "max": max(self.samples),
+                "buckets": buckets}
+
+
+class Telemetry:
+    """Per-server rolling histograms of the playback pipeline's stages
+
+    Timings: resolve, download, spawn (ffmpeg), first_audio (_play start
+    to player start), gap (between songs) and skip (command to next song).
+    Counts: cache hit/miss, kept as a rolling window as well."""
+
+    TIMINGS = ("resolve", "download", "spawn", "first_audio", "gap", "skip")
+
+    def __init__(self):
+        self.servers = collections.defaultdict(
+            lambda: collections.defaultdict(RollingHistogram))
+        self.cache = collections.defaultdict(
+            lambda: collections.deque(maxlen=TELEMETRY_SAMPLES))
+
+    def record(self, sid, stage, seconds):
+        self.servers[sid][stage].add(seconds)
+
+    @contextmanager
+    def timer(self, sid, stage):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(sid, stage, time.monotonic() - start)
+
+    def cache_lookup(self, sid, hit):
+        self.cache[sid].append(hit)
+
+    def merged(self, stage):
+        """One histogram of a stage across every server"""
+        histogram = RollingHistogram(size=None)
+        for stages in self.servers.values():
+            if stage in stages:
+                histogram.samples.extend(stages[stage].samples)
+        return histogram
+
+    def to_json(self, sid=None):
+        sids = [sid] if sid is not None else \
+            set(self.servers) | set(self.cache)
+        data = {}
+        for sid in sids:
+            stages = {stage: histogram.to_json() for stage, histogram
+                      in self.servers.get(sid, {}).items()
+                      if histogram.samples}
+            lookups = self.cache.get(sid)
+            if lookups:
+                stages["cache"] = {"hits": sum(lookups),
+                                   "misses": len(lookups) - sum(lookups)}
+            data[sid] = stages
+        return data
+
+
+def canonical_url(url):
+    """Maps the many spellings of a YouTube link to its video id, other
+    URLs lose their fragment and trailing slash"""
+    if url.startswith("[SEARCH:]"):
+        return "search:" + url[9:].strip().lower()
+    match = YOUTUBE_ID.search(url)
+    if match:
+        return "youtube:" + match.group(1)
+    return url.strip().split("#")[0].rstrip("/")
+
+
+class MetadataCache:
+    """TTL + LRU cache of extract_info results shared by every server
+
+    Only single videos are cached, playlists are always resolved fresh.
+    Worker threads read and write it, hence the lock."""
+
+    def __init__(self, path=METADATA_PATH, ttl=METADATA_TTL,
+                 max_entries=METADATA_MAX):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()  # key: (stored_at, info)
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        if not dataIO.is_valid_json(self.path):
+            return
+        data = dataIO.load_json(self.path)
+        now = time.time()
+        for key, (stored_at, info) in sorted(data.items(),
+                                             key=lambda kv: kv[1][0]):
+            if now - stored_at < self.ttl:
+                self.entries[key] = (stored_at, info)
+        self._trim()
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = dict(self.entries)
+            self.dirty = False
+        dataIO.save_json(self.path, data)
+
+    def get(self, url):
+        key = canonical_url(url)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry[0] >= self.ttl:
+                del self.entries[key]
+                self.dirty = True
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, url, info):
+        if info is None or "entries" in info or \
+                info.get("_type", "video") != "video":
+            return
+        info = {k: info[k] for k in METADATA_FIELDS if k in info}
+        keys = {canonical_url(url)}
+        if info.get("webpage_url"):
+            keys.add(canonical_url(info["webpage_url"]))
+        entry = (time.time(), info)
+        with self.lock:
+            for key in keys:
+                self.entries[key] = entry
+                self.entries.move_to_end(key)
+            self._trim()
+            self.dirty = True
+
+    def _trim(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class CacheIndex:
+    """In-memory view of the audio cache folder
+
+    Built with one scan at startup and then kept up to date as songs are
+    downloaded, played and evicted. Entries are kept in LRU order, pinned
+    songs (playing or prefetched) are never evicted."""
+
+    def __init__(self, store):
+        self.store = store
+        self.entries = collections.OrderedDict()  # id: [size, atime]
+        self.pins = collections.Counter()  # id: pin count
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.scan()
+
+    def scan(self):
+        self.entries.clear()
+        self.total = 0
+        found = []
+        for entry in os.scandir(self.store.path):
+            if not entry.is_file() or self.store.is_sidecar_file(entry.name):
+                continue
+            song_id = entry.name
+            if not self.store.is_complete(song_id):
+                log.debug("dropping incomplete cache file {}".format(song_id))
+                self.store.remove(song_id)
+                continue
+            record = self.store.read_sidecar(song_id)
+            atime = record.get("last_played") or entry.stat().st_mtime
+            found.append((atime, song_id, self.store.size_on_disk(song_id)))
+        for atime, song_id, size in sorted(found):
+            self.entries[song_id] = [size, atime]
+            self.total += size
+
+    def __contains__(self, song_id):
+        return song_id in self.entries
+
+    def size_mb(self):
+        return self.total / 10**6
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def peek(self, song_id):
+        """Checks for a cached song without counting it as a play"""
+        if song_id not in self.entries:
+            return False
+        if not os.path.isfile(self.store.audio_path(song_id)):
+            self._forget(song_id)  # Removed behind our back
+            return False
+        return True
+
+    def lookup(self, song_id):
+        """Checks for a cached song, counting the hit or miss"""
+        if not self.peek(song_id):
+            self.misses += 1
+            return False
+        self.hits += 1
+        self.touch(song_id)
+        self.store.mark_played(song_id)
+        return True
+
+    def add(self, song_id):
+        size = self.store.size_on_disk(song_id)
+        if not size:
+            return
+        if song_id in self.entries:
+            self._forget(song_id)
+        self.entries[song_id] = [size, time.time()]
+        self.total += size
 
-        if(video is not None):
-            self.song = Song(**video)
+    def touch(self, song_id):
+        if song_id in self.entries:
+            self.entries[song_id][1] = time.time()
+            self.entries.move_to_end(song_id)
+
+    def pin(self, song_id):
+        self.pins[song_id] += 1
+
+    def unpin(self, song_id):
+        self.pins[song_id] -= 1
+        if self.pins[song_id] <= 0:
+            del self.pins[song_id]
+
+    def remove(self, song_id):
+        try:
+            self.store.remove(song_id)
+        except OSError:
+            return 0  # Most likely in use
+        return self._forget(song_id)
+
+    def _forget(self, song_id):
+        size = self.entries.pop(song_id)[0]
+        self.total -= size
+        return size
+
+    def evict(self, max_bytes):
+        """Removes unpinned songs, least recently used first, until the
+        cache fits in max_bytes. Returns the number of bytes freed"""
+        freed = 0
+        for song_id in list(self.entries):
+            if self.total <= max_bytes:
+                break
+            if song_id not in self.pins:
+                freed += self.remove(song_id)
+        return freed
 
 
 class Audio:
@@ -309,10 +755,29 @@ class Audio:
         self.bot = bot
         self.queue = {}  # add deque's, repeat
         self.downloaders = {}  # sid: object
+        self.players = {}  # sid: player_loop task
+        self.wakeups = {}  # sid: asyncio.Event
+        self.prepared = {}  # sid: PreparedSong
+        self.started_at = {}  # sid: monotonic time the song started
+        self.ended_at = {}  # sid: monotonic time the last song ended
+        self.skip_requested = {}  # sid: monotonic time of the last skip
+        self.telemetry = Telemetry()
+        self.executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS)
+        self.metadata = MetadataCache()
+        self.ytdl_pool = YoutubeDLPool(youtube_dl_options)
         self.settings = dataIO.load_json("data/audio/settings.json")
         self.server_specific_setting_keys = ["VOLUME", "VOTE_ENABLED",
                                              "VOTE_THRESHOLD", "NOPPL_DISCONNECT"]
         self.cache_path = "data/audio/cache"
+        self.process_pool = self._make_process_pool()
+        self.cache_store = CacheStore(self.cache_path,
+                                      opus=self.settings["CACHE_OPUS"])
+        self.cache_store.clear_temp()
+        self.cache_index = CacheIndex(self.cache_store)
+        self.pins = {}  # (sid, "playing"/"prefetch"): song id
+        self.downloads = {}  # song id: Downloader downloading it
+        self.playlist_index = PlaylistIndex()
+        self.local_library = LocalLibrary("data/audio/localtracks")
         self.local_playlist_path = "data/audio/localtracks"
         self._old_game = False
 
@@ -325,6 +790,8 @@ class Audio:
         elif player == "avconv":
             self.settings["AVCONV"] = True
         self.save_settings()
+        self.cache_store.encoder = "avconv" if self.settings["AVCONV"] \
+            else "ffmpeg"
 
     async def _add_song_status(self, song):
         if self._old_game is False:
@@ -339,29 +806,21 @@ class Audio:
             self._setup_queue(server)
         queued_song = QueuedSong(url, channel)
         self.queue[server.id][QueueKey.QUEUE].append(queued_song)
+        self._wake_player(server)
 
     def _add_to_temp_queue(self, server, url, channel):
         if server.id not in self.queue:
             self._setup_queue(server)
         queued_song = QueuedSong(url, channel)
         self.queue[server.id][QueueKey.TEMP_QUEUE].append(queued_song)
+        self._wake_player(server)
 
     def _addleft_to_queue(self, server, url, channel):
         if server.id not in self.queue:
-            self._setup_queue()
+            self._setup_queue(server)
         queued_song = QueuedSong(url, channel)
         self.queue[server.id][QueueKey.QUEUE].appendleft(queued_song)
-
-    def _cache_desired_files(self):
-        filelist = []
-        for server in self.downloaders:
-            song = self.downloaders[server].song
-            try:
-                filelist.append(song.id)
-            except AttributeError:
-                pass
-        shuffle(filelist)
-        return filelist
+        self._wake_player(server)
 
     def _cache_max(self):
         setting_max = self.settings["MAX_CACHE"]
@@ -371,22 +830,8 @@ class Audio:
         x = self._server_count()
         return max([60, 48 * math.log(x) * x**0.3])  # log is not log10
 
-    def _cache_required_files(self):
-        queue = copy.deepcopy(self.queue)
-        filelist = []
-        for server in queue:
-            now_playing = queue[server].get(QueueKey.NOW_PLAYING)
-            try:
-                filelist.append(now_playing.id)
-            except AttributeError:
-                pass
-        return filelist
-
     def _cache_size(self):
-        songs = os.listdir(self.cache_path)
-        size = sum(map(lambda s: os.path.getsize(
-            os.path.join(self.cache_path, s)) / 10**6, songs))
-        return size
+        return self.cache_index.size_mb()
 
     def _cache_too_large(self):
         if self._cache_size() > self._cache_max():
@@ -399,7 +844,7 @@ class Audio:
         self.queue[server.id][QueueKey.QUEUE] = deque()
         self.queue[server.id][QueueKey.TEMP_QUEUE] = deque()
 
-    async def _create_ffmpeg_player(self, server, filename, local=False, start_time=None, end_time=None):
+    async def _create_ffmpeg_player(self, server, filename, local=False, start_time=None, end_time=None, stream_url=None):
         """This function will guarantee we have a valid voice client,
             even if one doesn't exist previously."""
         voice_channel_id = self.queue[server.id][QueueKey.VOICE_CHANNEL_ID]
@@ -425,11 +870,31 @@ class Audio:
 
         # Okay if we reach here we definitively have a working voice_client
 
-        if local:
+        if stream_url:
+            song_filename = stream_url
+        elif local:
             song_filename = os.path.join(self.local_playlist_path, filename)
         else:
-            song_filename = os.path.join(self.cache_path, filename)
+            song_filename = self.cache_store.play_path(filename)
+
+        try:
+            voice_client.audio_player.process.kill()
+            log.debug("killed old player")
+        except AttributeError:
+            pass
+        except ProcessLookupError:
+            pass
+
+        voice_client.audio_player = self._new_player(
+            server, voice_client, song_filename, start_time, end_time,
+            stream=stream_url is not None)
+
+        return voice_client  # Just for ease of use, it's modified in-place
 
+    def _new_player(self, server, voice_client, song_filename,
+                    start_time=None, end_time=None, stream=False):
+        """Spawns the ffmpeg process for a song, it won't be heard until
+        the player is started"""
         use_avconv = self.settings["AVCONV"]
         options = '-b:a 64k -bufsize 64k'
         before_options = ''
@@ -438,39 +903,40 @@ class Audio:
             before_options += '-ss {}'.format(start_time)
         if end_time:
             options += ' -to {} -copyts'.format(end_time)
-
-        try:
-            voice_client.audio_player.process.kill()
-            log.debug("killed old player")
-        except AttributeError:
-            pass
-        except ProcessLookupError:
-            pass
+        if stream:
+            if not use_avconv:  # avconv has no reconnect options
+                before_options += ' -reconnect 1 -reconnect_streamed 1' \
+                                  ' -reconnect_delay_max 5'
+            # Live streams have no duration to check beforehand
+            options += ' -t {}'.format(self.settings["MAX_LENGTH"])
 
         log.debug("making player on sid {}".format(server.id))
 
-        voice_client.audio_player = voice_client.create_ffmpeg_player(
-            song_filename, use_avconv=use_avconv, options=options, before_options=before_options)
+        with self.telemetry.timer(server.id, "spawn"):
+            player = voice_client.create_ffmpeg_player(
+                song_filename, use_avconv=use_avconv, options=options,
+                before_options=before_options,
+                after=lambda: self.bot.loop.call_soon_threadsafe(
+                    self._song_ended, server))
 
         # Set initial volume
         vol = self.get_server_settings(server)['VOLUME'] / 100
-        voice_client.audio_player.volume = vol
+        player.volume = vol
 
-        return voice_client  # Just for ease of use, it's modified in-place
+        return player
 
     # TODO: _current_playlist
 
     # TODO: _current_song
 
     def _delete_playlist(self, server, name):
-        if not name.endswith('.txt'):
-            name = name + ".txt"
+        if name.endswith('.txt'):
+            name = name[:-4]
         try:
-            os.remove(os.path.join('data/audio/playlists', server.id, name))
+            os.remove(self.playlist_index.file(server.id, name))
         except OSError:
             pass
-        except WindowsError:
-            pass
+        self.playlist_index.remove(server.id, name)
 
     # TODO: _disable_controls()
 
@@ -482,28 +948,62 @@ class Audio:
 
         await voice_client.disconnect()
 
-    async def _download_all(self, queued_song_list, channel):
+    async def _download_all(self, queued_song_list, channel, on_song=None):
         """
         Doesn't actually download, just get's info for uses like queue_list
+
+        Cached metadata is used as is, the rest goes through the worker
+        pool and on_song(index, song) is awaited as each one comes back.
         """
-        downloaders = []
-        for queued_song in queued_song_list:
-            d = Downloader(queued_song.url)
-            d.start()
-            downloaders.append(d)
-
-        while any([d.is_alive() for d in downloaders]):
-            await asyncio.sleep(0.1)
-            
-        songs = [d.song for d in downloaders if d.song is not None and d.error is None]
-           
-        invalid_downloads = [d for d in downloaders if d.error is not None]
-        invalid_number = len(invalid_downloads)
+        songs = [None] * len(queued_song_list)
+        pending = []
+        for i, queued_song in enumerate(queued_song_list):
+            info = self.metadata.get(queued_song.url)
+            if info is not None:
+                songs[i] = Song(**info)
+            else:
+                d = self._start_downloader(Downloader(queued_song.url))
+                pending.append(self._resolved(i, d))
+
+        invalid_number = 0
+        for future in asyncio.as_completed(pending):
+            i, d = await future
+            if d.error is not None:
+                invalid_number += 1
+            elif d.song is not None:
+                songs[i] = d.song
+                if on_song is not None:
+                    await on_song(i, d.song)
+
         if(invalid_number > 0):
             await self.bot.send_message(channel, "The queue contains {} item(s)"
                                             " that can not be played.".format(invalid_number))
 
-        return songs
+        return [song for song in songs if song is not None]
+
+    async def _resolved(self, index, downloader):
+        await downloader.wait()
+        return index, downloader
+
+    async def _resolve_playlist(self, scope, name, urls):
+        """Fills in a playlist's track metadata a few songs at a time, so
+        the worker pool stays free for whatever is playing"""
+        entry = self.playlist_index.get(scope, name)
+        if entry is None:
+            return
+        urls = [url for url in urls if url not in entry["tracks"]]
+        for i in range(0, len(urls), PLAYLIST_BATCH):
+            batch = [self._start_downloader(Downloader(url))
+                     for url in urls[i:i + PLAYLIST_BATCH]]
+            await asyncio.gather(*[d.wait() for d in batch])
+            for d in batch:
+                if d.song is not None and d.error is None:
+                    self.playlist_index.set_track(scope, name,
+                                                  d.requested_url, d.song)
+        if urls:
+            self.playlist_index.save()
+            log.debug("resolved {} tracks of playlist {}".format(len(urls),
+                                                                  name))
 
     async def _download_next(self, server, curr_dl, next_dl):
         """Checks to see if we need to download the next, and does.
@@ -516,9 +1016,10 @@ class Audio:
 
         max_length = self.settings["MAX_LENGTH"]
 
-        while next_dl.is_alive():
-            await asyncio.sleep(0.5)
-            
+        await next_dl.wait()
+        if next_dl.cancelled:
+            return
+
         error = next_dl.error
         if(error is not None):
             raise YouTubeDlError(error)
@@ -531,47 +1032,16 @@ class Audio:
                 next_dl.duration_check()
             except MaximumLength:
                 return
-            self.downloaders[server.id] = Downloader(next_dl.url, max_length,
-                                                     download=True)
-            self.downloaders[server.id].start()
-
-    def _dump_cache(self, ignore_desired=False):
-        reqd = self._cache_required_files()
-        log.debug("required cache files:\n\t{}".format(reqd))
-
-        opt = self._cache_desired_files()
-        log.debug("desired cache files:\n\t{}".format(opt))
-
-        prev_size = self._cache_size()
-
-        for file in os.listdir(self.cache_path):
-            if file not in reqd:
-                if ignore_desired or file not in opt:
-                    try:
-                        os.remove(os.path.join(self.cache_path, file))
-                    except OSError:
-                        # A directory got in the cache?
-                        pass
-                    except WindowsError:
-                        # Removing a file in use, reqd failed
-                        pass
-
-        post_size = self._cache_size()
-        dumped = prev_size - post_size
-
-        if not ignore_desired and self._cache_too_large():
-            log.debug("must dump desired files")
-            return dumped + self._dump_cache(ignore_desired=True)
+            self.downloaders[server.id] = self._start_download(
+                next_dl.requested_url, next_dl.song.id, max_length)
+            self._pin(server, "prefetch", next_dl.song.id)
 
+    def _dump_cache(self, max_size=0):
+        """Evicts unpinned songs until the cache is under max_size MB"""
+        dumped = self.cache_index.evict(max_size * 10**6) / 10**6
         log.debug("dumped {} MB of audio files".format(dumped))
-
         return dumped
 
-    # TODO: _enable_controls()
-
-    # returns list of active voice channels
-    # assuming list does not change during the execution of this function
-    # if that happens, blame asyncio.
     def _get_active_voice_clients(self):
         avcs = []
         for vc in self.bot.voice_clients:
@@ -635,23 +1105,21 @@ class Audio:
                 server.id))
             self.downloaders[server.id] = Downloader(url, max_length)
 
-        if self.downloaders[server.id].url != url:  # Our downloader is old
-            # I'm praying to Jeezus that we don't accidentally lose a running
-            #   Downloader
+        if self.downloaders[server.id].requested_url != url:  # Our downloader is old
             log.debug("sid {} in downloaders but wrong url".format(server.id))
+            self.downloaders[server.id].cancel()
             self.downloaders[server.id] = Downloader(url, max_length)
 
-        try:
-            # We're assuming we have the right thing in our downloader object
-            self.downloaders[server.id].start()
-            log.debug("starting our downloader for sid {}".format(server.id))
-        except RuntimeError:
-            # Queue manager already started it for us, isn't that nice?
-            pass
+        # A no-op if the queue manager already started it for us
+        dl = self._start_downloader(self.downloaders[server.id])
+
+        # Getting info, unless this is the queue manager's prefetch
+        stage = "download" if dl._download else "resolve"
+        with self.telemetry.timer(server.id, stage):
+            await dl.wait()
+        if dl.cancelled:
+            raise YouTubeDlError("The download was cancelled.")
 
-        # Getting info w/o download
-        self.downloaders[server.id].done.wait()
-        
         # Youtube-DL threw an exception.
         error = self.downloaders[server.id].error
         if(error is not None):
@@ -664,17 +1132,28 @@ class Audio:
         log.debug("sid {} wants to play songid {}".format(server.id, song.id))
 
         # Now we check to see if we have a cache hit
-        cache_location = os.path.join(self.cache_path, song.id)
-        if not os.path.exists(cache_location):
+        hit = self.cache_index.lookup(song.id)
+        self.telemetry.cache_lookup(server.id, hit)
+        if not hit:
             log.debug("cache miss on song id {}".format(song.id))
-            self.downloaders[server.id] = Downloader(url, max_length,
-                                                     download=True)
-            self.downloaders[server.id].start()
-
-            while self.downloaders[server.id].is_alive():
-                await asyncio.sleep(0.5)
-
-            song = self.downloaders[server.id].song
+            stream = self.settings["STREAM"]
+            if stream:
+                dl = Downloader(url, max_length, stream=True)
+            else:
+                dl = self._start_download(url, song.id, max_length)
+            self.downloaders[server.id] = dl
+            stage = "resolve" if stream else "download"
+            with self.telemetry.timer(server.id, stage):
+                await self._start_downloader(dl).wait()
+            if dl.cancelled:
+                raise YouTubeDlError("The download was cancelled.")
+            if dl.error is not None:
+                raise YouTubeDlError(dl.error)
+
+            song = dl.song
+            if stream:
+                song.stream_url = dl.stream_url
+                self._fill_cache(url, song.id, max_length)
         else:
             log.debug("cache hit on song id {}".format(song.id))
 
@@ -705,6 +1184,8 @@ class Audio:
                                  " please try again in 10 minutes.")
 
     def _list_local_playlists(self):
+        if self.local_library.covers():
+            return sorted(self.local_library.folders)
         ret = []
         for thing in os.listdir(self.local_playlist_path):
             if os.path.isdir(os.path.join(self.local_playlist_path, thing)):
@@ -717,16 +1198,7 @@ class Audio:
             server = server.id
         except:
             pass
-        path = "data/audio/playlists"
-        old_playlists = [f[:-4] for f in os.listdir(path)
-                         if f.endswith(".txt")]
-        path = os.path.join(path, server)
-        if os.path.exists(path):
-            new_playlists = [f[:-4] for f in os.listdir(path)
-                             if f.endswith(".txt")]
-        else:
-            new_playlists = []
-        return list(set(old_playlists + new_playlists))
+        return list(self.playlist_index.names(server))
 
     def _load_playlist(self, server, name, local=True):
         try:
@@ -734,12 +1206,9 @@ class Audio:
         except:
             pass
 
-        f = "data/audio/playlists"
-        if local:
-            f = os.path.join(f, server, name + ".txt")
-        else:
-            f = os.path.join(f, name + ".txt")
-        kwargs = dataIO.load_json(f)
+        scope = server if local else ""
+        f = self.playlist_index.file(scope, name)
+        kwargs = self.playlist_index.read(scope, name)
 
         kwargs['path'] = f
         kwargs['main_class'] = self
@@ -750,6 +1219,8 @@ class Audio:
         return Playlist(**kwargs)
 
     def _local_playlist_songlist(self, name):
+        if self.local_library.covers(name):
+            return self.local_library.folders[name]
         dirpath = os.path.join(self.local_playlist_path, name)
         return sorted(os.listdir(dirpath))
 
@@ -813,11 +1284,8 @@ class Audio:
 
     async def _parse_sc_playlist(self, url):
         playlist = []
-        d = Downloader(url)
-        d.start()
-
-        while d.is_alive():
-            await asyncio.sleep(0.5)
+        d = self._start_downloader(Downloader(url))
+        await d.wait()
 
         error = d.error
         if(error is not None):
@@ -833,12 +1301,9 @@ class Audio:
         return playlist
 
     async def _parse_yt_playlist(self, url):
-        d = Downloader(url)
-        d.start()
+        d = self._start_downloader(Downloader(url))
         playlist = []
-
-        while d.is_alive():
-            await asyncio.sleep(0.5)
+        await d.wait()
 
         error = d.error
         if(error is not None):
@@ -867,6 +1332,7 @@ class Audio:
 
         assert type(server) is discord.Server
         log.debug('starting to play on "{}"'.format(server.name))
+        play_start = time.monotonic()
 
         if self._valid_playable_url(url) or "[SEARCH:]" in url:
             clean_url = self._clean_url(url)
@@ -895,10 +1361,14 @@ class Audio:
         voice_client = await self._create_ffmpeg_player(server, song.id,
                                                         local=local,
                                                         start_time=song.start_time,
-                                                        end_time=song.end_time)
+                                                        end_time=song.end_time,
+                                                        stream_url=getattr(song, "stream_url", None))
         # That ^ creates the audio_player property
 
         voice_client.audio_player.start()
+        self._song_started(server)
+        self.telemetry.record(server.id, "first_audio",
+                              time.monotonic() - play_start)
         log.debug("starting player on sid {}".format(server.id))
 
         return song
@@ -946,8 +1416,7 @@ class Audio:
 
     def _player_count(self):
         count = 0
-        queue = copy.deepcopy(self.queue)
-        for sid in queue:
+        for sid in list(self.queue):
             server = self.bot.get_server(sid)
             try:
                 vc = self.voice_client(server)
@@ -962,11 +1431,7 @@ class Audio:
             self._playlist_exists_global(name)
 
     def _playlist_exists_global(self, name):
-        f = "data/audio/playlists"
-        f = os.path.join(f, name + ".txt")
-        log.debug('checking for {}'.format(f))
-
-        return dataIO.is_valid_json(f)
+        return self.playlist_index.get("", name) is not None
 
     def _playlist_exists_local(self, server, name):
         try:
@@ -974,11 +1439,7 @@ class Audio:
         except AttributeError:
             pass
 
-        f = "data/audio/playlists"
-        f = os.path.join(f, server, name + ".txt")
-        log.debug('checking for {}'.format(f))
-
-        return dataIO.is_valid_json(f)
+        return self.playlist_index.get(server, name) is not None
 
     def _remove_queue(self, server):
         if server.id in self.queue:
@@ -1008,6 +1469,7 @@ class Audio:
         log.debug("saving playlist '{}' to {}:\n\t{}".format(name, f,
                                                              playlist))
         dataIO.save_json(f, playlist)
+        self.playlist_index.update(sid, name)
 
     def _shuffle_queue(self, server):
         shuffle(self.queue[server.id][QueueKey.QUEUE])
@@ -1024,6 +1486,7 @@ class Audio:
         else:
             self._setup_queue(server)
         self.queue[server.id][QueueKey.QUEUE].extend(songlist)
+        self._wake_player(server)
 
     def _set_queue_channel(self, server, channel):
         if server.id not in self.queue:
@@ -1042,6 +1505,7 @@ class Audio:
 
         self.queue[server.id][QueueKey.NOW_PLAYING] = song
         self.queue[server.id][QueueKey.NOW_PLAYING_CHANNEL] = channel
+        self._pin(server, "playing", getattr(song, "id", None))
 
     def _set_queue_playlist(self, server, name=True):
         if server.id not in self.queue:
@@ -1056,6 +1520,7 @@ class Audio:
         self.queue[server.id][QueueKey.REPEAT] = value
 
     def _setup_queue(self, server):
+        self._unpin_server(server)
         self.queue[server.id] = {QueueKey.REPEAT: False, QueueKey.PLAYLIST: False,
                                  QueueKey.VOICE_CHANNEL_ID: None,
                                  QueueKey.QUEUE: deque(), QueueKey.TEMP_QUEUE: deque(),
@@ -1075,9 +1540,84 @@ class Audio:
         if server.id not in self.downloaders:
             return
 
-        del self.downloaders[server.id]
+        self.downloaders.pop(server.id).cancel()
+
+    def _start_downloader(self, downloader):
+        if downloader.future is None:
+            downloader.start(self.bot.loop,
+                             self.process_pool or self.executor,
+                             self.metadata, self.ytdl_pool, self.cache_store)
+            downloader.future.add_done_callback(
+                lambda f: self._download_finished(downloader))
+        return downloader
+
+    def _start_download(self, url, song_id, max_length):
+        """Downloads song_id, or joins the download of it that's already
+        running. Two jobs writing the same temp file would race on the
+        rename. Returns a Downloader the caller is free to cancel"""
+        job = self.downloads.get(song_id)
+        if job is None or job.cancelled or job.future.done():
+            job = Downloader(url, max_length, download=True)
+            self.downloads[song_id] = job
+
+            def finished(future):
+                if self.downloads.get(song_id) is job:
+                    del self.downloads[song_id]
+            self._start_downloader(job).future.add_done_callback(finished)
+        return job.follow(self.bot.loop)
+
+    def _fill_cache(self, url, song_id, max_length):
+        """Downloads a song being streamed so later plays hit the cache"""
+        self._start_download(url, song_id, max_length)
+
+    def _make_process_pool(self):
+        processes = self.settings["WORKER_PROCESSES"]
+        if not processes:
+            return None
+        pool = make_process_pool(processes)
+        if pool is None:
+            log.warning("worker processes need Python 3.7 or later here,"
+                        " downloads will run on threads")
+        return pool
+
+    def _download_finished(self, downloader):
+        if downloader.broken_pool is not None and \
+                downloader.broken_pool is self.process_pool:
+            log.warning("worker process pool is broken, starting a new one")
+            self.process_pool = self._make_process_pool()
+            downloader.broken_pool.shutdown(wait=False)
+        if downloader._download and not downloader.cancelled and \
+                downloader.error is None and downloader.song is not None:
+            self.cache_index.add(downloader.song.id)
+
+    def _pin(self, server, role, song_id):
+        """Pins song_id in the cache for this server, releasing whatever
+        was pinned for the same role before"""
+        old = self.pins.pop((server.id, role), None)
+        if old is not None:
+            self.cache_index.unpin(old)
+        if song_id is not None:
+            self.cache_index.pin(song_id)
+            self.pins[(server.id, role)] = song_id
+
+    def _unpin_server(self, server):
+        for role in ("playing", "prefetch"):
+            self._pin(server, role, None)
+
+    def _cancel_skipped_download(self, server):
+        """Drops a job still working on the song being skipped. A prefetch
+        of the next song is left alone, the queue manager picks it up"""
+        dl = self.downloaders.get(server.id)
+        if dl is None or not dl.is_alive():
+            return
+        now_playing = self._get_queue_nowplaying(server)
+        if now_playing is not None and dl.song is not None and \
+                dl.song.id == now_playing.id:
+            dl.cancel()
+            del self.downloaders[server.id]
 
     def _stop_player(self, server):
+        self._discard_prepared(server)
         if not self.voice_connected(server):
             return
 
@@ -1183,11 +1723,70 @@ class Audio:
         """Toggles between Ffmpeg and Avconv"""
         self.settings["AVCONV"] = not self.settings["AVCONV"]
         if self.settings["AVCONV"]:
+            self.cache_store.encoder = "avconv"
             await self.bot.say("Player toggled. You're now using avconv.")
         else:
+            self.cache_store.encoder = "ffmpeg"
             await self.bot.say("Player toggled. You're now using ffmpeg.")
         self.save_settings()
 
+    @audioset.command(name="stream")
+    @checks.is_owner()
+    async def audioset_stream(self):
+        """Toggles streaming songs that aren't cached yet
+
+        Playback starts as soon as the song is resolved instead of after
+        the download, the file still gets cached in the background."""
+        self.settings["STREAM"] = not self.settings["STREAM"]
+        if self.settings["STREAM"]:
+            await self.bot.say("Uncached songs will now be streamed.")
+        else:
+            await self.bot.say("Songs will be downloaded before playing.")
+        self.save_settings()
+
+    @audioset.command(name="workers")
+    @checks.is_owner()
+    async def audioset_workers(self, processes: int):
+        """Sets how many worker processes resolve and download songs
+
+        0 keeps the work on threads inside the bot process. Jobs already
+        running finish where they started. Workers are started with
+        forkserver, or spawn on Windows, never forked from the bot, which
+        needs Python 3.7 or later everywhere but Windows."""
+        if processes < 0:
+            await self.bot.say("That's not a valid number of processes.")
+            return
+        self.settings["WORKER_PROCESSES"] = processes
+        self.save_settings()
+        old_pool = self.process_pool
+        self.process_pool = self._make_process_pool()
+        if old_pool is not None:
+            old_pool.shutdown(wait=False)
+        if processes and self.process_pool is None:
+            await self.bot.say("Worker processes need Python 3.7 or later "
+                               "on this system, downloads still run on "
+                               "threads.")
+        elif processes:
+            await self.bot.say("Downloads now run in {} worker "
+                               "processes.".format(processes))
+        else:
+            await self.bot.say("Downloads now run on threads.")
+
+    @audioset.command(name="cacheopus")
+    @checks.is_owner()
+    async def audioset_cacheopus(self):
+        """Toggles keeping an Opus copy of new downloads
+
+        Costs disk space and an encode per download, saves the player from
+        decoding other codecs at play time."""
+        self.settings["CACHE_OPUS"] = not self.settings["CACHE_OPUS"]
+        self.cache_store.opus = self.settings["CACHE_OPUS"]
+        if self.settings["CACHE_OPUS"]:
+            await self.bot.say("New downloads will be kept as Opus too.")
+        else:
+            await self.bot.say("New downloads won't be transcoded anymore.")
+        self.save_settings()
+
     @audioset.command(name="status")
     @checks.is_owner()  # cause effect is cross-server
     async def audioset_status(self):
@@ -1269,6 +1868,62 @@ class Audio:
         await self.bot.say("Currently playing music in {} servers.".format(
             count))
 
+    @audiostat.command(name="gaps")
+    async def audiostat_gaps(self):
+        """Silence between songs over the last few tracks."""
+        gaps = self.telemetry.merged("gap")
+        if not gaps.samples:
+            await self.bot.say("No song transitions recorded yet.")
+            return
+        await self.bot.say("Gap between songs over {} transitions:\n"
+                           "Median: {:.0f} ms\n"
+                           "Worst: {:.0f} ms".format(
+                               len(gaps.samples), gaps.percentile(0.5) * 1000,
+                               max(gaps.samples) * 1000))
+
+    @audiostat.command(pass_context=True, name="latency")
+    @checks.is_owner()
+    async def audiostat_latency(self, ctx, server_id: str=None):
+        """Where playback time goes, per stage
+
+        Covers every server unless a server id is given."""
+        lines = []
+        for stage in Telemetry.TIMINGS:
+            if server_id is None:
+                histogram = self.telemetry.merged(stage)
+            else:
+                histogram = self.telemetry.servers.get(server_id, {}).get(
+                    stage, RollingHistogram())
+            if not histogram.samples:
+                continue
+            lines.append("{:<12}{:>6}{:>9.0f}{:>9.0f}{:>9.0f}".format(
+                stage, len(histogram.samples),
+                histogram.percentile(0.5) * 1000,
+                histogram.percentile(0.95) * 1000,
+                max(histogram.samples) * 1000))
+        if server_id is None:
+            lookups = [hit for window in self.telemetry.cache.values()
+                       for hit in window]
+        else:
+            lookups = list(self.telemetry.cache.get(server_id, []))
+        if not lines and not lookups:
+            await self.bot.say("Nothing recorded yet.")
+            return
+        msg = "{:<12}{:>6}{:>9}{:>9}{:>9}\n".format("stage", "n", "p50 ms",
+                                                    "p95 ms", "max ms")
+        msg += "\n".join(lines)
+        if lookups:
+            msg += "\n\nCache hit ratio: {:.1%} of {} lookups".format(
+                sum(lookups) / len(lookups), len(lookups))
+        await self.bot.say(box(msg))
+
+    @audiostat.command(name="dump")
+    @checks.is_owner()
+    async def audiostat_dump(self):
+        """Uploads every server's stage histograms as JSON."""
+        dataIO.save_json(TELEMETRY_PATH, self.telemetry.to_json())
+        await self.bot.upload(TELEMETRY_PATH)
+
     @commands.group(pass_context=True)
     async def cache(self, ctx):
         """Cache management tools."""
@@ -1289,13 +1944,19 @@ class Audio:
             - Current size of the cache.
             - Maximum cache size. User setting or minimum, whichever is higher.
             - Minimum cache size. Automatically determined by number of servers Red is running on.
+            - Number of cached songs and how often plays were cache hits.
         """
+        index = self.cache_index
         await self.bot.say("Cache stats:\n"
                            "Current size: {:.2f} MB\n"
                            "Maximum: {:.1f} MB\n"
-                           "Minimum: {:.1f} MB".format(self._cache_size(),
-                                                       self._cache_max(),
-                                                       self._cache_min()))
+                           "Minimum: {:.1f} MB\n"
+                           "Songs: {} ({} pinned)\n"
+                           "Hit ratio: {:.1%} ({} hits, {} misses)".format(
+                               self._cache_size(), self._cache_max(),
+                               self._cache_min(), len(index.entries),
+                               sum(1 for i in index.pins if i in index),
+                               index.hit_ratio(), index.hits, index.misses))
 
     @commands.group(pass_context=True, hidden=True, no_pm=True)
     @checks.is_owner()
@@ -1398,6 +2059,31 @@ class Audio:
         else:
             await self.bot.say("There are no playlists.")
 
+    @local.command(name="search")
+    async def local_search(self, *, terms):
+        """Searches local tracks by title, artist, album or file name"""
+        library = self.local_library
+        keys = library.search(terms)
+        if not keys:
+            await self.bot.say("No local tracks found.")
+            return
+        lines = []
+        for key in keys[:LOCAL_RESULTS]:
+            track = library.tracks[key]
+            line = key
+            if track.get("title"):
+                line += " - {}".format(track["title"])
+                if track.get("artist"):
+                    line += " ({})".format(track["artist"])
+            if track.get("duration"):
+                line += " [{}:{:0>2}]".format(*divmod(track["duration"], 60))
+            lines.append(line)
+        msg = "\n".join(lines)
+        if len(keys) > LOCAL_RESULTS:
+            msg += "\n...and {} more.".format(len(keys) - LOCAL_RESULTS)
+        for page in pagify(msg, delims=["\n"]):
+            await self.bot.say(page)
+
     @commands.command(pass_context=True, no_pm=True)
     async def pause(self, ctx):
         """Pauses the current song, `[p]resume` to continue."""
@@ -1612,7 +2298,14 @@ class Audio:
     async def playlist_list(self, ctx):
         """Lists all available playlists"""
         server = ctx.message.server
-        playlists = ", ".join(self._list_playlists(server))
+        index = self.playlist_index
+        playlists = []
+        for name in sorted(self._list_playlists(server)):
+            entry = index.get(server.id, name) or index.get("", name)
+            if entry is None:  # Deleted or unreadable since it was indexed
+                continue
+            playlists.append("{} ({})".format(name, entry["count"]))
+        playlists = ", ".join(playlists)
         if playlists:
             playlists = "Available playlists:\n\n" + playlists
             for page in pagify(playlists, delims=[" "]):
@@ -1714,9 +2407,31 @@ class Audio:
 
             self._play_playlist(server, playlist, channel)
             await self.bot.say("Playlist queued.")
+            scope = server.id if self._playlist_exists_local(server, name) \
+                else ""
+            # The player task takes track 1, the rest resolve behind it
+            self.bot.loop.create_task(self._resolve_playlist(
+                scope, name, playlist.playlist[1:]))
         else:
             await self.bot.say("That playlist does not exist.")
 
+    @playlist.command(pass_context=True, no_pm=True, name="info")
+    async def playlist_info(self, ctx, name):
+        """Shows what's known about a playlist's tracks."""
+        server = ctx.message.server
+        scope = server.id if self._playlist_exists_local(server, name) else ""
+        entry = self.playlist_index.get(scope, name)
+        if entry is None:
+            await self.bot.say("That playlist does not exist.")
+            return
+        duration = sum(t["duration"] or 0 for t in entry["tracks"].values())
+        m, s = divmod(int(duration), 60)
+        h, m = divmod(m, 60)
+        await self.bot.say("Playlist '{}': {} tracks, {} resolved, "
+                           "{}:{:0>2}:{:0>2} known length.".format(
+                               name, entry["count"], len(entry["tracks"]),
+                               h, m, s))
+
     @playlist.command(pass_context=True, no_pm=True, name="mix")
     async def playlist_start_mix(self, ctx, name):
         """Plays and mixes a playlist."""
@@ -1729,9 +2444,14 @@ class Audio:
         If you use `queue` when one song is playing, your new song will get
             added to the song loop (if running). If you use `queue` when a
             playlist is running, it will temporarily be played next and will
-            NOT stay in the playlist loop."""
+            NOT stay in the playlist loop.
+
+        Use `queue` alone to list what's next, `queue page <n>` for more."""
         if url is None:
             return await self._queue_list(ctx)
+        page = url.lower().split()
+        if len(page) == 2 and page[0] == "page" and page[1].isdigit():
+            return await self._queue_list(ctx, int(page[1]))
         server = ctx.message.server
         channel = ctx.message.channel
         if not self.voice_connected(server):
@@ -1773,49 +2493,65 @@ class Audio:
             self._add_to_queue(server, url, channel)
         await self.bot.say("Queued.")
 
-    async def _queue_list(self, ctx):
+    async def _queue_list(self, ctx, page=1):
         """Not a command, use `queue` with no args to call this."""
         server = ctx.message.server
         channel = ctx.message.channel
         if server.id not in self.queue:
             await self.bot.say("Nothing playing on this server!")
             return
-        elif len(self.queue[server.id][QueueKey.QUEUE]) == 0:
+
+        temp_queue = self.queue[server.id][QueueKey.TEMP_QUEUE]
+        main_queue = self.queue[server.id][QueueKey.QUEUE]
+        total = len(temp_queue) + len(main_queue)
+        if total == 0:
             await self.bot.say("Nothing queued on this server.")
             return
 
-        msg = ""
+        pages = math.ceil(total / QUEUE_PAGE)
+        page = min(max(page, 1), pages)
+        first = (page - 1) * QUEUE_PAGE
+        # Temp queue plays first, only the visible page gets resolved
+        queued_song_list = list(itertools.islice(
+            itertools.chain(temp_queue, main_queue), first, first + QUEUE_PAGE))
 
+        header = ""
         now_playing = self._get_queue_nowplaying(server)
-
         if now_playing is not None:
-            msg += "\n***Now playing:***\n{}\n".format(now_playing.title)
-
-        queued_song_list = self._get_queue(server, 5)
-        tempqueued_song_list = self._get_queue_tempqueue(server, 5)
-
-        await self.bot.say("Gathering information...")
-
-        queue_song_list = await self._download_all(queued_song_list, channel)
-        tempqueue_song_list = await self._download_all(tempqueued_song_list, channel)
+            header += "\n***Now playing:***\n{}\n".format(now_playing.title)
+        header += "\n***Next up:*** (page {}/{})\n".format(page, pages)
+
+        lines = ["{}. {}".format(num, self._clean_url(queued_song.url))
+                 for num, queued_song in enumerate(queued_song_list,
+                                                   first + 1)]
+
+        def set_line(i, song):
+            name = getattr(song, "title", None) or song.webpage_url
+            lines[i] = "{}. {}".format(first + i + 1, name)
+
+        unresolved = []
+        for i, queued_song in enumerate(queued_song_list):
+            info = self.metadata.get(queued_song.url)
+            if info is not None:
+                set_line(i, Song(**info))
+            else:
+                unresolved.append(i)
 
-        song_info = []
-        for num, song in enumerate(tempqueue_song_list, 1):
-            try:
-                song_info.append("{}. {.title}".format(num, song))
-            except AttributeError:
-                song_info.append("{}. {.webpage_url}".format(num, song))
+        message = await self.bot.say(header + "\n".join(lines))
+        if not unresolved:
+            return
+        last_edit = time.monotonic()
 
-        for num, song in enumerate(queue_song_list, len(song_info) + 1):
-            if num > 5:
-                break
-            try:
-                song_info.append("{}. {.title}".format(num, song))
-            except AttributeError:
-                song_info.append("{}. {.webpage_url}".format(num, song))
-        msg += "\n***Next up:***\n" + "\n".join(song_info)
+        async def on_song(j, song):
+            nonlocal last_edit
+            set_line(unresolved[j], song)
+            if time.monotonic() - last_edit >= QUEUE_EDIT_INTERVAL:
+                last_edit = time.monotonic()
+                await self.bot.edit_message(message, header + "\n".join(lines))
 
-        await self.bot.say(msg)
+        await self._download_all([queued_song_list[i] for i in unresolved],
+                                 channel, on_song)
+        await self.bot.edit_message(message, header + "\n".join(lines))
 
     @commands.group(pass_context=True, no_pm=True)
     async def repeat(self, ctx):
@@ -1894,7 +2630,10 @@ class Audio:
             vc = self.voice_client(server)
             if msg.author.voice_channel == vchan:
                 if self.can_instaskip(msg.author):
+                    self._cancel_skipped_download(server)
+                    self.skip_requested[server.id] = time.monotonic()
                     vc.audio_player.stop()
+                    self._wake_player(server)
                     if self._get_queue_repeat(server) is False:
                         self._set_queue_nowplaying(server, None, None)
                     await self.bot.say("Skipping...")
@@ -1914,7 +2653,10 @@ class Audio:
                     thresh = self.get_server_settings(server)["VOTE_THRESHOLD"]
 
                     if vote >= thresh:
+                        self._cancel_skipped_download(server)
+                        self.skip_requested[server.id] = time.monotonic()
                         vc.audio_player.stop()
+                        self._wake_player(server)
                         if self._get_queue_repeat(server) is False:
                             self._set_queue_nowplaying(server, None, None)
                         self.skip_votes[server.id] = []
@@ -2033,9 +2775,29 @@ class Audio:
                 # Our cache is too big, dumping
                 log.debug("cache too large ({} > {}), dumping".format(
                     self._cache_size(), self._cache_max()))
-                self._dump_cache()
+                self._dump_cache(self._cache_max())
             await asyncio.sleep(5)  # No need to run this every half second
 
+    async def local_indexer(self):
+        while self == self.bot.get_cog("Audio"):
+            started = time.time()
+            try:
+                # Not the download pool, a first scan can probe for a while
+                tracks = await self.bot.loop.run_in_executor(
+                    None, self.local_library.scan)
+            except OSError as e:
+                log.warning("couldn't index local tracks: {}".format(e))
+            else:
+                if self.local_library.apply(tracks, started):
+                    log.debug("local library now has {} tracks".format(
+                        len(tracks)))
+            await asyncio.sleep(LOCAL_SCAN)
+
+    async def metadata_flusher(self):
+        while self == self.bot.get_cog("Audio"):
+            await asyncio.sleep(METADATA_FLUSH)
+            self.metadata.save()
+
     async def cache_scheduler(self):
         await asyncio.sleep(30)  # Extra careful
 
@@ -2177,9 +2939,10 @@ class Audio:
                     return
                 if repeat and last_song:
                     queued_last_song = QueuedSong(last_song.webpage_url, last_song_channel)
-                    queue.append(last_song.webpage_url)
+                    queue.append(queued_last_song)
             else:
                 song = None
+                channel = None
             self._set_queue_nowplaying(server, song, channel)
             log.debug("set now_playing for sid {}".format(server.id))
             self.bot.loop.create_task(self._update_bot_status())
@@ -2203,7 +2966,7 @@ class Audio:
             if next_dl is not None:
                 try:
                     # Download next song
-                    next_dl.start()
+                    self._start_downloader(next_dl)
                     await self._download_next(server, curr_dl, next_dl)
                 except YouTubeDlError as e:
                     if len(temp_queue) > 0:
@@ -2216,23 +2979,171 @@ class Audio:
                     message = escape(message, mass_mentions=True)
                     await self.bot.send_message(next_channel, message)
 
-    async def queue_scheduler(self):
-        while self == self.bot.get_cog('Audio'):
-            tasks = []
-            queue = copy.deepcopy(self.queue)
-            for sid in queue:
-                if len(queue[sid][QueueKey.QUEUE]) == 0 and \
-                        len(queue[sid][QueueKey.TEMP_QUEUE]) == 0:
-                    continue
-                # log.debug("scheduler found a non-empty queue"
-                #           " for sid: {}".format(sid))
-                tasks.append(
-                    self.bot.loop.create_task(self.queue_manager(sid)))
-            completed = [t.done() for t in tasks]
-            while not all(completed):
-                completed = [t.done() for t in tasks]
-                await asyncio.sleep(0.5)
-            await asyncio.sleep(1)
+    def _wake_player(self, server):
+        """Nudges the server's player task, starting one if needed. Called
+        on enqueue, skip and when the ffmpeg player finishes a song"""
+        if server.id in self.wakeups:
+            self.wakeups[server.id].set()
+        if server.id not in self.players or self.players[server.id].done():
+            self.wakeups[server.id] = asyncio.Event()
+            self.players[server.id] = self.bot.loop.create_task(
+                self.player_loop(server.id))
+
+    def _has_queued(self, server):
+        return server.id in self.queue and \
+            (len(self.queue[server.id][QueueKey.QUEUE]) > 0 or
+             len(self.queue[server.id][QueueKey.TEMP_QUEUE]) > 0)
+
+    async def player_loop(self, sid):
+        """Drives one server's queue and sleeps until woken. Exits once
+        nothing is playing or queued, the next enqueue starts a new one"""
+        server = self.bot.get_server(sid)
+        wakeup = self.wakeups[sid]
+        while self == self.bot.get_cog("Audio") and sid in self.queue:
+            wakeup.clear()
+            was_playing = self.is_playing(server)
+            try:
+                await self.queue_manager(sid)
+            except Exception:
+                log.exception("queue manager failed on sid {}".format(sid))
+                await asyncio.sleep(1)
+            if not self.is_playing(server) and not self._has_queued(server):
+                self._queue_finished(server)
+                break
+            if was_playing:
+                # Next song is prefetched, nothing to do until this one ends
+                await self._wait_for_song_end(server, wakeup)
+        log.debug("player task for sid {} is idle".format(sid))
+
+    def _queue_finished(self, server):
+        """Clears now playing once the last song is over"""
+        if self._get_queue_nowplaying(server) is None:
+            return
+        self._set_queue_nowplaying(server, None, None)
+        self.bot.loop.create_task(self._update_bot_status())
+
+    async def _wait_for_song_end(self, server, wakeup):
+        """Sleeps until woken, getting the next song's player ready
+        PLAYER_PRELOAD seconds before the current one is due to end"""
+        remaining = self._time_remaining(server)
+        if remaining is not None and server.id not in self.prepared:
+            try:
+                await asyncio.wait_for(wakeup.wait(),
+                                       max(remaining - PLAYER_PRELOAD, 0))
+                return
+            except asyncio.TimeoutError:
+                await self._prepare_next(server)
+        await wakeup.wait()
+
+    def _time_remaining(self, server):
+        song = self._get_queue_nowplaying(server)
+        if song is None or server.id not in self.started_at or \
+                not song.duration:
+            return None
+        return song.duration - (time.monotonic() - self.started_at[server.id])
+
+    def _next_queued(self, server):
+        for key in (QueueKey.TEMP_QUEUE, QueueKey.QUEUE):
+            if len(self.queue[server.id][key]) > 0:
+                return self.queue[server.id][key][0], key
+        return None, None
+
+    async def _prepare_next(self, server):
+        """Spawns the player for the head of the queue ahead of time, as
+        long as the prefetch already has it in the cache"""
+        queued_song, key = self._next_queued(server)
+        dl = self.downloaders.get(server.id)
+        if queued_song is None or dl is None or not dl._download or \
+                dl.requested_url != queued_song.url:
+            return
+        await dl.wait()
+        if dl.cancelled or dl.error is not None or dl.song is None:
+            return
+        if self._next_queued(server)[0] is not queued_song or \
+                not self.is_playing(server):
+            return  # The queue moved on while we were waiting
+        try:
+            dl.duration_check()
+        except MaximumLength:
+            return
+        if not self.cache_index.peek(dl.song.id):
+            return
+        voice_client = self.voice_client(server)
+        player = self._new_player(server, voice_client,
+                                  self.cache_store.play_path(dl.song.id),
+                                  dl.song.start_time, dl.song.end_time)
+        self.prepared[server.id] = PreparedSong(queued_song, key, dl.song,
+                                                player)
+        log.debug("prepared player for songid {} on sid {}".format(
+            dl.song.id, server.id))
+
+    def _discard_prepared(self, server):
+        prepared = self.prepared.pop(server.id, None)
+        if prepared is None:
+            return
+        try:
+            prepared.player.process.kill()
+        except (AttributeError, ProcessLookupError):
+            pass
+
+    def _switch_to_prepared(self, server):
+        """Starts the prepared player if it's still the right song.
+        Returns whether it did"""
+        prepared = self.prepared.get(server.id)
+        voice_client = self.voice_client(server)
+        if prepared is None or voice_client is None or \
+                self._next_queued(server)[0] is not prepared.queued_song:
+            self._discard_prepared(server)
+            return False
+        del self.prepared[server.id]
+
+        queue = self.queue[server.id]
+        last_song = queue[QueueKey.NOW_PLAYING]
+        last_song_channel = queue[QueueKey.NOW_PLAYING_CHANNEL]
+        queue[prepared.queue_key].popleft()
+        if prepared.queue_key is QueueKey.QUEUE and \
+                queue[QueueKey.REPEAT] and last_song:
+            queue[QueueKey.QUEUE].append(
+                QueuedSong(last_song.webpage_url, last_song_channel))
+
+        # Counted here rather than in _prepare_next, it may be discarded
+        hit = self.cache_index.lookup(prepared.song.id)
+        self.telemetry.cache_lookup(server.id, hit)
+        player = prepared.player
+        player.volume = self.get_server_settings(server)['VOLUME'] / 100
+        voice_client.audio_player = player
+        player.start()
+        self._song_started(server)
+
+        self.skip_votes[server.id] = []
+        self._set_queue_nowplaying(server, prepared.song,
+                                   prepared.queued_song.channel)
+        self.bot.loop.create_task(self._update_bot_status())
+        return True
+
+    def _song_ended(self, server):
+        """The ffmpeg player's after callback, run on the event loop"""
+        # When a replaced player finishes, is_playing is still True
+        if not self.is_playing(server) and self._has_queued(server):
+            self.ended_at[server.id] = time.monotonic()
+            if self._switch_to_prepared(server):
+                log.debug("switched to prepared player on sid {}".format(
+                    server.id))
+        elif not self._has_queued(server):
+            self.skip_requested.pop(server.id, None)  # Nothing to skip to
+        self._wake_player(server)
+
+    def _song_started(self, server):
+        now = time.monotonic()
+        self.started_at[server.id] = now
+        ended = self.ended_at.pop(server.id, None)
+        if ended is not None:
+            self.telemetry.record(server.id, "gap", now - ended)
+            log.debug("inter-track gap on sid {}: {:.3f}s".format(
+                server.id, now - ended))
+        skipped = self.skip_requested.pop(server.id, None)
+        if skipped is not None:
+            self.telemetry.record(server.id, "skip", now - skipped)
 
     async def reload_monitor(self):
         while self == self.bot.get_cog('Audio'):
@@ -2293,13 +3204,24 @@ class Audio:
                 vc.audio_player.resume()
 
     def __unload(self):
+        for task in self.players.values():
+            task.cancel()
+        for dl in self.downloaders.values():
+            dl.cancel()
+        for sid in list(self.prepared):
+            self._discard_prepared(discord.Object(id=sid))
+        self.executor.shutdown(wait=False)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False)
+        self.metadata.save()
         for vc in self.bot.voice_clients:
             self.bot.loop.create_task(vc.disconnect())
 
 
 def check_folders():
-    folders = ("data/audio", "data/audio/cache", "data/audio/playlists",
-               "data/audio/localtracks", "data/audio/sfx")
+    folders = ("data/audio", "data/audio/cache", "data/audio/cache/.tmp",
+               "data/audio/playlists", "data/audio/localtracks",
+               "data/audio/sfx")
     for folder in folders:
         if not os.path.exists(folder):
             print("Creating " + folder + " folder...")
@@ -2310,6 +3232,7 @@ def check_files():
     default = {"VOLUME": 50, "MAX_LENGTH": 3700, "VOTE_ENABLED": True,
                "MAX_CACHE": 0, "SOUNDCLOUD_CLIENT_ID": None,
                "TITLE_STATUS": True, "AVCONV": False, "VOTE_THRESHOLD": 50,
+               "CACHE_OPUS": False, "STREAM": False, "WORKER_PROCESSES": 0,
                "SERVERS": {}}
     settings_path = "data/audio/settings.json"
 
@@ -2380,7 +3303,8 @@ def setup(bot):
     n = Audio(bot, player=player)  # Praise 26
     bot.add_cog(n)
     bot.add_listener(n.voice_state_update, 'on_voice_state_update')
-    bot.loop.create_task(n.queue_scheduler())
     bot.loop.create_task(n.disconnect_timer())
     bot.loop.create_task(n.reload_monitor())
     bot.loop.create_task(n.cache_scheduler())
+    bot.loop.create_task(n.metadata_flusher())
+    bot.loop.create_task(n.local_indexer())
@@ -2,8 +2,125 @@ from discord.ext import commands
 from .utils.dataIO import dataIO
 from .utils import checks
 from .utils.chat_formatting import pagify, box
+from .utils.transfer import (attachment_format, fetch_attachment,
+                             read_rows, row_writer)
+from collections import Counter
+from bisect import bisect_right
+from operator import attrgetter
+from random import choice
+import asyncio
+import heapq
 import os
 import re
+import time
+
+FIELD = re.compile(r"\{([^}]+)\}")
+LIST_PAGE = 50
+
+# For security reasons only specific objects are allowed
+OBJECTS = {
+    "message" : lambda message: message,
+    "author"  : attrgetter("author"),
+    "channel" : attrgetter("channel"),
+    "server"  : attrgetter("server")
+}
+
+
+class CompiledCommand:
+    """A custom command's text compiled once into segments
+
+    Supported fields:
+        {author.name}   - attributes of message, author, channel, server
+        {0}, {1}...     - the command's arguments
+        {random:a|b|c}  - one of the choices, picked at random
+
+    Unknown fields are left as they are. Rendering is a single pass
+    over the segments followed by a join."""
+
+    def __init__(self, text):
+        self.text = text
+        self.segments = []  # str or (kind, ...) tuples
+        last = 0
+        for match in FIELD.finditer(text):
+            self._add_literal(text[last:match.start()])
+            segment = self._compile_field(match.group(1))
+            if segment is None:
+                self._add_literal(match.group(0))
+            else:
+                self.segments.append(segment)
+            last = match.end()
+        self._add_literal(text[last:])
+
+    def render(self, message, args=()):
+        out = []
+        for segment in self.segments:
+            if isinstance(segment, str):
+                out.append(segment)
+            elif segment[0] == "attr":
+                _, getter, attribute, raw = segment
+                obj = getter(message)
+                if attribute is None:
+                    out.append(str(obj))
+                else:
+                    out.append(str(getattr(obj, attribute, raw)))
+            elif segment[0] == "arg":
+                if segment[1] < len(args):
+                    out.append(args[segment[1]])
+            else:  # random
+                out.append(choice(segment[1]))
+        return "".join(out)
+
+    def _add_literal(self, text):
+        if not text:
+            return
+        if self.segments and isinstance(self.segments[-1], str):
+            self.segments[-1] += text
+        else:
+            self.segments.append(text)
+
+    def _compile_field(self, field):
+        """Internals are ignored, unknown fields are left as they are"""
+        raw = "{" + field + "}"
+        if field.isdigit():
+            return ("arg", int(field))
+        if field.startswith("random:"):
+            return ("random", tuple(field[7:].split("|")))
+        if field in OBJECTS:
+            return ("attr", OBJECTS[field], None, raw)
+        try:
+            first, second = field.split(".")
+        except ValueError:
+            return None
+        if first in OBJECTS and not second.startswith("_"):
+            return ("attr", OBJECTS[first], second, raw)
+        return None
+
+
+class Cooldowns:
+    """Tracks when keys can be used again
+
+    Expired entries are purged through a heap as time passes, so the
+    structure only holds the cooldowns that are still running"""
+
+    def __init__(self):
+        self._expiry = {}  # key: time.monotonic() it expires at
+        self._heap = []
+
+    def remaining(self, key):
+        self._purge()
+        return max(0, self._expiry.get(key, 0) - time.monotonic())
+
+    def trigger(self, key, seconds):
+        expiry = time.monotonic() + seconds
+        self._expiry[key] = expiry
+        heapq.heappush(self._heap, (expiry, key))
+
+    def _purge(self):
+        now = time.monotonic()
+        while self._heap and self._heap[0][0] <= now:
+            expiry, key = heapq.heappop(self._heap)
+            if self._expiry.get(key) == expiry:
+                del self._expiry[key]
 
 
 class CustomCommands:
@@ -15,6 +132,19 @@ class CustomCommands:
         self.bot = bot
         self.file_path = "data/customcom/commands.json"
         self.c_commands = dataIO.load_json(self.file_path)
+        self.cooldowns_path = "data/customcom/cooldowns.json"
+        self.cooldown_settings = dataIO.load_json(self.cooldowns_path)
+        self.cooldowns = Cooldowns()
+        self.hits_path = "data/customcom/hits.json"
+        self.hits = {sid: Counter(hits) for sid, hits
+                     in dataIO.load_json(self.hits_path).items()}
+        self.hits_dirty = False
+        # Lowercased command name index, that's what messages are matched on
+        self.compiled = {}  # sid: {command: CompiledCommand}
+        self._sorted = {}  # sid: sorted command names, for cc_list
+        for sid, cmdlist in self.c_commands.items():
+            for command, text in cmdlist.items():
+                self._compile(sid, command, text)
 
     @commands.group(aliases=["cc"], pass_context=True, no_pm=True)
     async def customcom(self, ctx):
@@ -32,6 +162,9 @@ class CustomCommands:
 
         CCs can be enhanced with arguments:
         https://twentysix26.github.io/Red-Docs/red_guide_command_args/
+
+        {0}, {1}... are replaced by the words typed after the command
+        and {random:a|b|c} by one of the choices
         """
         server = ctx.message.server
         command = command.lower()
@@ -44,6 +177,7 @@ class CustomCommands:
         if command not in cmdlist:
             cmdlist[command] = text
             self.c_commands[server.id] = cmdlist
+            self._compile(server.id, command, text)
             dataIO.save_json(self.file_path, self.c_commands)
             await self.bot.say("Custom command successfully added.")
         else:
@@ -66,6 +200,7 @@ class CustomCommands:
             if command in cmdlist:
                 cmdlist[command] = text
                 self.c_commands[server.id] = cmdlist
+                self._compile(server.id, command, text)
                 dataIO.save_json(self.file_path, self.c_commands)
                 await self.bot.say("Custom command successfully edited.")
             else:
@@ -91,6 +226,13 @@ class CustomCommands:
             if command in cmdlist:
                 cmdlist.pop(command, None)
                 self.c_commands[server.id] = cmdlist
+                self.compiled.get(server.id, {}).pop(command, None)
+                self._sorted.pop(server.id, None)
+                if self.hits.get(server.id, {}).pop(command, None):
+                    self.hits_dirty = True
+                if self.cooldown_settings.get(server.id, {}).pop(command, None):
+                    dataIO.save_json(self.cooldowns_path,
+                                     self.cooldown_settings)
                 dataIO.save_json(self.file_path, self.c_commands)
                 await self.bot.say("Custom command successfully deleted.")
             else:
@@ -100,26 +242,145 @@ class CustomCommands:
                                " Use `{}customcom add` to start adding some."
                                "".format(ctx.prefix))
 
+    @customcom.command(name="cooldown", pass_context=True)
+    @checks.mod_or_permissions(administrator=True)
+    async def cc_cooldown(self, ctx, command : str, seconds : int):
+        """Sets how often a custom command can be used. 0 to disable
+
+        Example:
+        [p]customcom cooldown yourcommand 30"""
+        server = ctx.message.server
+        command = command.lower()
+        if command not in self.c_commands.get(server.id, {}):
+            await self.bot.say("That command doesn't exist.")
+            return
+        if seconds < 0:
+            await self.bot.say("The cooldown can't be negative.")
+            return
+        cooldowns = self.cooldown_settings.setdefault(server.id, {})
+        if seconds:
+            cooldowns[command] = seconds
+            msg = "`{}` can now be used once every {} seconds."
+        else:
+            cooldowns.pop(command, None)
+            msg = "`{}` no longer has a cooldown."
+        dataIO.save_json(self.cooldowns_path, self.cooldown_settings)
+        await self.bot.say(msg.format(command, seconds))
+
+    @customcom.command(name="stats", pass_context=True)
+    @checks.serverowner_or_permissions(administrator=True)
+    async def cc_stats(self, ctx, top : int=10):
+        """Shows the most used custom commands of the server"""
+        server = ctx.message.server
+        hits = self.hits.get(server.id)
+        if not hits:
+            await self.bot.say("No custom command has been used yet.")
+            return
+        top = max(1, top)
+        lines = ["{}{:<30}{:>8}".format(ctx.prefix, cmd, count)
+                 for cmd, count in hits.most_common(top)]
+        for page in pagify("\n".join(lines)):
+            await self.bot.say(box(page))
+
     @customcom.command(name="list", pass_context=True)
-    async def cc_list(self, ctx):
-        """Shows custom commands list"""
+    async def cc_list(self, ctx, after : str=None):
+        """Shows custom commands list
+
+        Shows 50 commands at a time. To see the next ones pass the
+        last command shown, e.g. [p]customcom list yourcommand"""
         server = ctx.message.server
-        commands = self.c_commands.get(server.id, {})
+        names = self._sorted_names(server.id)
 
-        if not commands:
+        if not names:
             await self.bot.say("There are no custom commands in this server."
                                " Use `{}customcom add` to start adding some."
                                "".format(ctx.prefix))
             return
 
-        commands = ", ".join([ctx.prefix + c for c in sorted(commands)])
-        commands = "Custom commands:\n\n" + commands
+        start = bisect_right(names, after.lower()) if after else 0
+        page = names[start:start + LIST_PAGE]
+        if not page:
+            await self.bot.say("There are no more custom commands.")
+            return
+
+        msg = "Custom commands ({}-{} of {}):\n\n".format(
+            start + 1, start + len(page), len(names))
+        msg += ", ".join([ctx.prefix + c for c in page])
+        msg = box(msg)
+        if start + len(page) < len(names):
+            msg += "\nNext page: `{}customcom list {}`".format(ctx.prefix,
+                                                               page[-1])
+        await self.bot.say(msg)
 
-        if len(commands) < 1500:
-            await self.bot.say(box(commands))
-        else:
-            for page in pagify(commands, delims=[" ", "\n"]):
-                await self.bot.whisper(box(page))
+    @customcom.command(name="export", pass_context=True)
+    @checks.mod_or_permissions(administrator=True)
+    async def cc_export(self, ctx, fmt : str="csv"):
+        """Exports the server's custom commands as csv or jsonl"""
+        server = ctx.message.server
+        fmt = fmt.lower()
+        if fmt not in ("csv", "jsonl"):
+            await self.bot.say("Format must be either csv or jsonl.")
+            return
+        cmdlist = self.c_commands.get(server.id)
+        if not cmdlist:
+            await self.bot.say("There are no custom commands in this server.")
+            return
+        path = "data/customcom/export-{}.{}".format(server.id, fmt)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            write = row_writer(f, ("command", "text"), fmt)
+            for command, text in cmdlist.items():
+                write((command, text))
+        await self.bot.upload(path)
+        os.remove(path)
+
+    @customcom.command(name="import", pass_context=True)
+    @checks.mod_or_permissions(administrator=True)
+    async def cc_import(self, ctx):
+        """Imports custom commands from an attached csv or jsonl file
+
+        The file must have the same columns as the ones made by
+        customcom export. Existing commands are overwritten."""
+        message = ctx.message
+        server = message.server
+        fmt = attachment_format(message)
+        path = "data/customcom/import-{}.{}".format(server.id, fmt)
+        if not await fetch_attachment(message, path):
+            await self.bot.say("Attach a csv or jsonl file made with "
+                               "`{}customcom export`.".format(ctx.prefix))
+            return
+
+        pending = {}
+        skipped = 0
+        try:
+            with open(path, encoding="utf-8", newline="") as f:
+                for row in read_rows(f, fmt):
+                    command = row["command"]
+                    text = row["text"]
+                    # Same rules as customcom add, names can have spaces
+                    if not isinstance(command, str) or \
+                            not isinstance(text, str) or \
+                            not command.strip() or not text or \
+                            command.lower() in self.bot.commands:
+                        skipped += 1
+                        continue
+                    pending[command.lower()] = text
+        except (KeyError, ValueError, TypeError, AttributeError):
+            await self.bot.say("That file is not valid. Nothing was "
+                               "imported.")
+            return
+        finally:
+            os.remove(path)
+
+        if pending:
+            cmdlist = self.c_commands.setdefault(server.id, {})
+            for command, text in pending.items():
+                cmdlist[command] = text
+                self._compile(server.id, command, text)
+            dataIO.save_json(self.file_path, self.c_commands)
+        msg = "{} custom commands imported.".format(len(pending))
+        if skipped:
+            msg += " {} rows were skipped.".format(skipped)
+        await self.bot.say(msg)
 
     async def on_message(self, message):
         if len(message.content) < 2 or message.channel.is_private:
@@ -131,17 +392,26 @@ class CustomCommands:
         if not prefix:
             return
 
-        if server.id in self.c_commands and self.bot.user_allowed(message):
-            cmdlist = self.c_commands[server.id]
-            cmd = message.content[len(prefix):]
-            if cmd in cmdlist:
-                cmd = cmdlist[cmd]
-                cmd = self.format_cc(cmd, message)
-                await self.bot.send_message(message.channel, cmd)
-            elif cmd.lower() in cmdlist:
-                cmd = cmdlist[cmd.lower()]
-                cmd = self.format_cc(cmd, message)
-                await self.bot.send_message(message.channel, cmd)
+        cmdlist = self.compiled.get(server.id)
+        if not cmdlist:
+            return
+
+        content = message.content[len(prefix):]
+        cmd, _, args = content.partition(" ")
+        cmd = cmd.lower()
+        compiled = cmdlist.get(cmd)
+        if compiled is None and args:
+            # Names with spaces ("good morning") only match as a whole
+            cmd, args = content.lower(), ""
+            compiled = cmdlist.get(cmd)
+
+        if compiled is not None and self.bot.user_allowed(message) and \
+                not self.on_cooldown(server.id, cmd):
+            args = args.split(" ") if args else []
+            self.hits.setdefault(server.id, Counter())[cmd] += 1
+            self.hits_dirty = True
+            text = compiled.render(message, args)
+            await self.bot.send_message(message.channel, text)
 
     def get_prefix(self, message):
         for p in self.bot.settings.get_prefixes(message.server):
@@ -149,36 +419,40 @@ class CustomCommands:
                 return p
         return False
 
-    def format_cc(self, command, message):
-        results = re.findall("\{([^}]+)\}", command)
-        for result in results:
-            param = self.transform_parameter(result, message)
-            command = command.replace("{" + result + "}", param)
-        return command
+    def on_cooldown(self, sid, command):
+        """Checks the command's cooldown, starting it if it's not running"""
+        seconds = self.cooldown_settings.get(sid, {}).get(command)
+        if not seconds:
+            return False
+        key = (sid, command)
+        if self.cooldowns.remaining(key):
+            return True
+        self.cooldowns.trigger(key, seconds)
+        return False
 
-    def transform_parameter(self, result, message):
-        """
-        For security reasons only specific objects are allowed
-        Internals are ignored
-        """
-        raw_result = "{" + result + "}"
-        objects = {
-            "message" : message,
-            "author"  : message.author,
-            "channel" : message.channel,
-            "server"  : message.server
-        }
-        if result in objects:
-            return str(objects[result])
-        try:
-            first, second = result.split(".")
-        except ValueError:
-            return raw_result
-        if first in objects and not second.startswith("_"):
-            first = objects[first]
-        else:
-            return raw_result
-        return str(getattr(first, second, raw_result))
+    def format_cc(self, command, message, args=()):
+        return CompiledCommand(command).render(message, args)
+
+    def _compile(self, sid, command, text):
+        self.compiled.setdefault(sid, {})[command.lower()] = \
+            CompiledCommand(text)
+        self._sorted.pop(sid, None)
+
+    def _sorted_names(self, sid):
+        if sid not in self._sorted:
+            self._sorted[sid] = sorted(self.compiled.get(sid, {}))
+        return self._sorted[sid]
+
+    async def hits_flusher(self):
+        while self == self.bot.get_cog("CustomCommands"):
+            self.save_hits()
+            await asyncio.sleep(60)
+        self.save_hits()
+
+    def save_hits(self):
+        if self.hits_dirty:
+            self.hits_dirty = False
+            dataIO.save_json(self.hits_path, self.hits)
 
 
 def check_folders():
@@ -193,8 +467,20 @@ def check_files():
         print("Creating empty commands.json...")
         dataIO.save_json(f, {})
 
+    f = "data/customcom/cooldowns.json"
+    if not dataIO.is_valid_json(f):
+        print("Creating empty cooldowns.json...")
+        dataIO.save_json(f, {})
+
+    f = "data/customcom/hits.json"
+    if not dataIO.is_valid_json(f):
+        print("Creating empty hits.json...")
+        dataIO.save_json(f, {})
+
 
 def setup(bot):
     check_folders()
     check_files()
-    bot.add_cog(CustomCommands(bot))
+    n = CustomCommands(bot)
+    bot.add_cog(n)
+    bot.loop.create_task(n.hits_flusher())
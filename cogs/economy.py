@@ -6,9 +6,13 @@ from datetime import datetime
 from copy import deepcopy
 from .utils import checks
 from cogs.utils.chat_formatting import pagify, box
+from cogs.utils.transfer import (attachment_format, fetch_attachment,
+                                 read_rows, row_writer)
 from enum import Enum
 from __main__ import send_cmd_help
 import os
+import csv
+import math
 import time
 import logging
 import random
@@ -54,6 +58,10 @@ class SameSenderAndReceiver(BankError):
     pass
 
 
+class InvalidImportFormat(BankError):
+    pass
+
+
 NUM_ENC = "\N{COMBINING ENCLOSING KEYCAP}"
 
 
@@ -109,6 +117,8 @@ SLOT_PAYOUTS_MSG = ("Slot machine payouts:\n"
                     "Three symbols: +500\n"
                     "Two symbols: Bet * 2".format(**SMReel.__dict__))
 
+EXPORT_FIELDS = ("server_id", "user_id", "name", "balance", "created_at")
+
 
 class Bank:
 
@@ -200,6 +210,93 @@ class Bank:
         self.accounts[server.id] = {}
         self._save_bank()
 
+    def bulk_update(self, server, user_ids=None, *, delta=0, multiplier=1):
+        """Applies balance * multiplier + delta to many accounts at once
+
+        If user_ids is None every account of the server is affected.
+        Users without an account are skipped and balances never go
+        below 0. Every balance is computed before any is changed and the
+        bank is saved only once at the end.
+        Returns the number of updated accounts"""
+        server_accounts = self.accounts.get(server.id, {})
+        if user_ids is None:
+            user_ids = list(server_accounts.keys())
+        pending = []
+        for user_id in user_ids:
+            account = server_accounts.get(user_id)
+            if account is None:
+                continue
+            balance = int(account["balance"] * multiplier) + delta
+            pending.append((account, max(balance, 0)))
+        for account, balance in pending:
+            account["balance"] = balance
+        if pending:
+            self._save_bank()
+        return len(pending)
+
+    def export_bank(self, fp, server=None, *, fmt="csv"):
+        """Writes accounts to an open text file one row at a time
+
+        Exports every server if server is None. fmt is csv or jsonl"""
+        if server is None:
+            server_ids = list(self.accounts.keys())
+        else:
+            server_ids = [server.id]
+        try:
+            write = row_writer(fp, EXPORT_FIELDS, fmt)
+        except ValueError:
+            raise InvalidImportFormat()
+        rows = 0
+        for server_id in server_ids:
+            for user_id, account in self.accounts.get(server_id, {}).items():
+                if not isinstance(account, dict) or "created_at" not in account:
+                    continue  # Legacy account
+                row = (server_id, user_id, account["name"],
+                       account["balance"], account["created_at"])
+                write(row)
+                rows += 1
+        return rows
+
+    def import_bank(self, fp, server, *, fmt="csv"):
+        """Reads accounts from an open text file one row at a time
+
+        Rows are applied to the given server: existing accounts get their
+        balance overwritten, missing ones are created. Nothing is changed
+        if any row is invalid and the bank is saved only once at the end.
+        Returns the number of imported rows"""
+        try:
+            rows = read_rows(fp, fmt)
+        except ValueError:
+            raise InvalidImportFormat()
+        timestamp = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        pending = {}
+        try:
+            for row in rows:
+                user_id = str(row["user_id"])
+                if not user_id.isdigit():
+                    raise ValueError(user_id)
+                balance = int(row["balance"])
+                if balance < 0:
+                    raise NegativeValue()
+                created_at = row.get("created_at") or timestamp
+                # Same format _create_account_obj reads back
+                datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S")
+                pending[user_id] = (str(row.get("name") or user_id),
+                                    created_at, balance)
+        except (KeyError, ValueError, TypeError, AttributeError):
+            raise InvalidImportFormat()
+        if not pending:
+            return 0
+        server_accounts = self.accounts.setdefault(server.id, {})
+        for user_id, (name, created_at, balance) in pending.items():
+            account = server_accounts.get(user_id)
+            if account is None:
+                account = {"name": name, "created_at": created_at}
+                server_accounts[user_id] = account
+            account["balance"] = balance
+        self._save_bank()
+        return len(pending)
+
     def get_server_accounts(self, server):
         if server.id in self.accounts:
             raw_server_accounts = deepcopy(self.accounts[server.id])
@@ -280,6 +377,25 @@ class SetParser:
             raise
 
 
+class BulkParser:
+    def __init__(self, argument):
+        self.delta = 0
+        self.multiplier = 1
+        if argument and argument[0] in ("+", "-"):
+            self.delta = int(argument)
+        elif argument and argument[0] in ("x", "*"):
+            self.multiplier = float(argument[1:])
+            if self.multiplier < 0 or not math.isfinite(self.multiplier):
+                raise ValueError()
+        else:
+            raise ValueError()
+
+    def __str__(self):
+        if self.delta:
+            return "{:+}".format(self.delta)
+        return "x{}".format(self.multiplier)
+
+
 class Economy:
     """Economy
 
@@ -398,6 +514,116 @@ class Economy:
         except NoAccount:
             await self.bot.say("User has no bank account.")
 
+    @_bank.group(name="bulk", pass_context=True, no_pm=True)
+    @checks.admin_or_permissions(manage_server=True)
+    async def _bulk(self, ctx):
+        """Changes many bank accounts at once
+
+        Operations:
+            +100  - Adds 100 credits
+            -100  - Removes 100 credits (balances stop at 0)
+            x0.9  - Multiplies balances by 0.9"""
+        if ctx.invoked_subcommand is None or \
+                isinstance(ctx.invoked_subcommand, commands.Group):
+            await send_cmd_help(ctx)
+
+    @_bulk.command(name="role", pass_context=True, no_pm=True)
+    async def _bulk_role(self, ctx, role: discord.Role,
+                         operation: BulkParser):
+        """Applies an operation to every member with a role
+
+        Example:
+            bank bulk role Winners +500"""
+        server = ctx.message.server
+        user_ids = [m.id for m in server.members if role in m.roles]
+        await self._bulk_apply(ctx, user_ids, operation)
+
+    @_bulk.command(name="all", pass_context=True, no_pm=True)
+    async def _bulk_all(self, ctx, operation: BulkParser):
+        """Applies an operation to every account of the server
+
+        Example:
+            bank bulk all x0.95 - Monthly 5% decay"""
+        await self._bulk_apply(ctx, None, operation)
+
+    @_bulk.command(name="csv", pass_context=True, no_pm=True)
+    async def _bulk_csv(self, ctx, operation: BulkParser):
+        """Applies an operation to the users listed in an attached CSV
+
+        The first column of each row must be a user ID"""
+        server = ctx.message.server
+        path = "data/economy/bulk-{}.csv".format(server.id)
+        if not await fetch_attachment(ctx.message, path):
+            await self.bot.say("Attach a CSV file with one user ID per row.")
+            return
+        try:
+            with open(path, encoding="utf-8", newline="") as f:
+                user_ids = [row[0].strip() for row in csv.reader(f)
+                            if row and row[0].strip().isdigit()]
+        finally:
+            os.remove(path)
+        await self._bulk_apply(ctx, user_ids, operation)
+
+    @_bank.command(name="export", pass_context=True, no_pm=True)
+    @checks.admin_or_permissions(manage_server=True)
+    async def _export(self, ctx, fmt: str="csv"):
+        """Exports the server's bank accounts as csv or jsonl"""
+        server = ctx.message.server
+        fmt = fmt.lower()
+        if fmt not in ("csv", "jsonl"):
+            await self.bot.say("Format must be either csv or jsonl.")
+            return
+        path = "data/economy/export-{}.{}".format(server.id, fmt)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            rows = self.bank.export_bank(f, server, fmt=fmt)
+        if rows:
+            await self.bot.upload(path)
+        else:
+            await self.bot.say("There are no accounts in the bank.")
+        os.remove(path)
+
+    @_bank.command(name="import", pass_context=True, no_pm=True)
+    @checks.serverowner_or_permissions(administrator=True)
+    async def _import(self, ctx):
+        """Imports bank accounts from an attached csv or jsonl file
+
+        The file must have the same columns as the ones made by
+        bank export. Existing balances are overwritten."""
+        message = ctx.message
+        server = message.server
+        author = message.author
+        fmt = attachment_format(message)
+        path = "data/economy/import-{}.{}".format(server.id, fmt)
+        if not await fetch_attachment(message, path):
+            await self.bot.say("Attach a csv or jsonl file made with "
+                               "`{}bank export`.".format(ctx.prefix))
+            return
+        try:
+            with open(path, encoding="utf-8", newline="") as f:
+                imported = self.bank.import_bank(f, server, fmt=fmt)
+        except (InvalidImportFormat, NegativeValue):
+            await self.bot.say("That file is not valid. Nothing was "
+                               "imported.")
+        else:
+            logger.info("{}({}) imported {} bank accounts on server {}"
+                        "".format(author.name, author.id, imported,
+                                  server.id))
+            await self.bot.say("{} accounts have been imported."
+                               "".format(imported))
+        finally:
+            os.remove(path)
+
+    async def _bulk_apply(self, ctx, user_ids, operation):
+        server = ctx.message.server
+        author = ctx.message.author
+        updated = self.bank.bulk_update(server, user_ids,
+                                        delta=operation.delta,
+                                        multiplier=operation.multiplier)
+        logger.info("{}({}) applied {} to {} accounts on server {}".format(
+            author.name, author.id, operation, updated, server.id))
+        await self.bot.say("Applied {} to {} bank accounts."
+                           "".format(operation, updated))
+
     @_bank.command(pass_context=True, no_pm=True)
     @checks.serverowner_or_permissions(administrator=True)
     async def reset(self, ctx, confirmation: bool=False):
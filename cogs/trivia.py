@@ -1,31 +1,413 @@
 from discord.ext import commands
-from random import choice
+from random import choice, sample, shuffle
 from .utils.dataIO import dataIO
 from .utils import checks
-from .utils.chat_formatting import box
+from .utils.chat_formatting import box, pagify
+from __main__ import send_cmd_help
 from collections import Counter, defaultdict, namedtuple
+from bisect import bisect_left, insort
 import discord
 import time
 import os
 import asyncio
+import logging
 import chardet
+from chardet.universaldetector import UniversalDetector
 
 DEFAULTS = {"MAX_SCORE"    : 10,
             "TIMEOUT"      : 120,
             "DELAY"        : 15,
             "BOT_PLAYS"    : False,
-            "REVEAL_ANSWER": True}
+            "REVEAL_ANSWER": True,
+            "FUZZY"        : 0}
 
-TriviaLine = namedtuple("TriviaLine", "question answers")
+# Lists with at least this many questions are read straight from disk
+LARGE_LIST = 5000
+CATALOG_REFRESH = 60
+STATS_FLUSH = 30
+RANKED_METRICS = ("points", "wins")
+
+TriviaLine = namedtuple("TriviaLine", "question answers words phrases")
+
+log = logging.getLogger("red.trivia")
+
+
+def parse_trivia_list(path):
+    """Reads and parses a trivia list file
+
+    The file is read only once. Most lists are utf-8, so chardet
+    only runs when that fails.
+    Returns (encoding, [TriviaLine, ...])"""
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    encoding = "utf-8-sig"  # Also strips a BOM
+    try:
+        content = raw.decode(encoding)
+    except UnicodeDecodeError:
+        try:
+            encoding = chardet.detect(raw)["encoding"] or "ISO-8859-1"
+        except:
+            encoding = "ISO-8859-1"
+        content = raw.decode(encoding, errors="replace")
+
+    parsed_list = []
+    for line in content.splitlines():
+        line = parse_trivia_line(line)
+        if line is not None:
+            parsed_list.append(line)
+
+    if not parsed_list:
+        raise ValueError("Empty trivia list")
+
+    return encoding, parsed_list
+
+
+def parse_trivia_line(line):
+    if "`" not in line:
+        return None
+    line = line.split("`")
+    question = line[0]
+    answers = [l.strip() for l in line[1:]]
+    answers = [a for a in answers if a]
+    if not question or not answers:
+        return None
+    normalized = [a.lower() for a in answers]
+    # Single word answers must match a whole word of the guess (issue #331)
+    # while answers with spaces only need to appear somewhere in it
+    words = frozenset(a for a in normalized if " " not in a)
+    phrases = tuple(a for a in normalized if " " in a)
+    return TriviaLine(question=question, answers=answers, words=words,
+                      phrases=phrases)
+
+
+def index_trivia_list(path):
+    """Finds the encoding and the byte offset of every question line
+    without keeping the file in memory
+
+    Returns (encoding, offsets)"""
+    encoding = "utf-8-sig"
+    try:
+        offsets = _question_offsets(path, encoding)
+    except UnicodeDecodeError:
+        encoding = detect_encoding(path)
+        offsets = _question_offsets(path, encoding, errors="replace")
+    return encoding, offsets
+
+
+def _question_offsets(path, encoding, errors="strict"):
+    offsets = []
+    offset = 0
+    with open(path, "rb") as f:
+        for raw in f:
+            if b"`" in raw:
+                line = parse_trivia_line(raw.decode(encoding, errors))
+                if line is not None:
+                    offsets.append(offset)
+            offset += len(raw)
+    return offsets
+
+
+def detect_encoding(path):
+    detector = UniversalDetector()
+    with open(path, "rb") as f:
+        for raw in f:
+            detector.feed(raw)
+            if detector.done:
+                break
+    detector.close()
+    return detector.result["encoding"] or "ISO-8859-1"
+
+
+def read_trivia_lines(path, encoding, offsets):
+    """Yields the questions at the given offsets in random order,
+    reading one line at a time"""
+    order = list(range(len(offsets)))
+    shuffle(order)
+    with open(path, "rb") as f:
+        for i in order:
+            f.seek(offsets[i])
+            raw = f.readline()
+            line = parse_trivia_line(raw.decode(encoding, errors="replace"))
+            if line is not None:
+                yield line
+
+
+def bounded_edit_distance(a, b, limit):
+    """Levenshtein distance between a and b
+
+    Gives up and returns limit + 1 as soon as the distance is
+    known to be larger than limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) > len(b):
+        a, b = b, a
+    previous = list(range(len(a) + 1))
+    for i, cb in enumerate(b, 1):
+        current = [i]
+        for j, ca in enumerate(a, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class FuzzyMatcher:
+    """Approximate answer matching for a single question
+
+    Each answer tolerates up to a quarter of its length in edits, capped
+    by max_edits, so short answers still need to be exact. Candidates
+    are the guess' word windows with as many words as the answer and
+    are filtered by length and character counts before the edit
+    distance is computed."""
+
+    def __init__(self, line, max_edits):
+        self.answers = []  # (answer, word count, tolerance, char bag)
+        for answer in list(line.words) + list(line.phrases):
+            tolerance = min(max_edits, len(answer) // 4)
+            if tolerance > 0:
+                self.answers.append((answer, answer.count(" ") + 1,
+                                     tolerance, Counter(answer)))
+
+    def matches(self, tokens):
+        windows = {}  # word count: [candidate, ...]
+        bags = {}  # candidate: Counter
+        for answer, size, tolerance, bag in self.answers:
+            if size not in windows:
+                windows[size] = [" ".join(tokens[i:i + size])
+                                 for i in range(len(tokens) - size + 1)]
+            for candidate in windows[size]:
+                if abs(len(candidate) - len(answer)) > tolerance:
+                    continue
+                if candidate not in bags:
+                    bags[candidate] = Counter(candidate)
+                candidate_bag = bags[candidate]
+                # Every edit fixes at most one surplus char on each side
+                if max(sum((bag - candidate_bag).values()),
+                       sum((candidate_bag - bag).values())) > tolerance:
+                    continue
+                if bounded_edit_distance(answer, candidate,
+                                         tolerance) <= tolerance:
+                    return True
+        return False
+
+
+class TriviaListCache:
+    """Parsed trivia lists, keyed by path and invalidated by mtime"""
+
+    def __init__(self):
+        self._entries = {}  # path: (mtime, encoding, lines)
+
+    def get(self, path):
+        """Returns the cached lines or None on a miss"""
+        entry = self._entries.get(path)
+        if entry is None:
+            return None
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            self._entries.pop(path, None)
+            raise FileNotFoundError(path)
+        if mtime != entry[0]:
+            del self._entries[path]
+            return None
+        return entry[2]
+
+    def load(self, path):
+        """Parses the file and stores it. Meant to run in an executor"""
+        mtime = os.path.getmtime(path)
+        encoding, lines = parse_trivia_list(path)
+        self._entries[path] = (mtime, encoding, lines)
+        return lines
+
+    def is_warm(self, path):
+        entry = self._entries.get(path)
+        if entry is None:
+            return False
+        try:
+            return os.path.getmtime(path) == entry[0]
+        except OSError:
+            return False
+
+    def encoding(self, path):
+        entry = self._entries.get(path)
+        return entry[1] if entry else None
+
+
+class TriviaCatalog:
+    """On-disk index of the available trivia lists
+
+    index.json keeps the mtime, size, encoding and question count of
+    every list. The byte offsets of each list's questions are kept in
+    index/<name>.json and only loaded when a game needs them."""
+
+    def __init__(self, lists_path="data/trivia"):
+        self.lists_path = lists_path
+        self.path = os.path.join(lists_path, "index.json")
+        self.offsets_path = os.path.join(lists_path, "index")
+        if dataIO.is_valid_json(self.path):
+            self.entries = dataIO.load_json(self.path)
+        else:
+            self.entries = {}
+
+    def list_path(self, name):
+        return os.path.join(self.lists_path, name + ".txt")
+
+    def refresh(self):
+        """Indexes new or modified lists and forgets deleted ones
+
+        Blocking, meant to run in an executor"""
+        entries = {}
+        changed = False
+        for filename in os.listdir(self.lists_path):
+            if not filename.endswith(".txt") or " " in filename:
+                continue
+            name = filename[:-4]
+            try:
+                stat = os.stat(self.list_path(name))
+            except OSError:
+                continue
+            entry = self.entries.get(name)
+            if entry and entry["mtime"] == stat.st_mtime and \
+                    entry["size"] == stat.st_size:
+                entries[name] = entry
+                continue
+            try:
+                encoding, offsets = index_trivia_list(self.list_path(name))
+            except Exception as e:
+                log.warning("Could not index trivia list {}: {}"
+                            "".format(name, e))
+                continue
+            dataIO.save_json(self._offsets_file(name), offsets)
+            entries[name] = {"mtime": stat.st_mtime, "size": stat.st_size,
+                             "encoding": encoding, "count": len(offsets)}
+            changed = True
+        for name in set(self.entries) - set(entries):
+            try:
+                os.remove(self._offsets_file(name))
+            except OSError:
+                pass
+            changed = True
+        self.entries = entries
+        if changed:
+            dataIO.save_json(self.path, entries)
+        return changed
+
+    def is_current(self, name):
+        """Whether the index still matches the file on disk"""
+        entry = self.entries.get(name)
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(self.list_path(name))
+        except OSError:
+            return False
+        return entry["mtime"] == stat.st_mtime and \
+            entry["size"] == stat.st_size
+
+    def load_offsets(self, name):
+        return dataIO.load_json(self._offsets_file(name))
+
+    def search(self, term=None):
+        """Returns sorted (name, question count) pairs"""
+        term = term.lower() if term else None
+        return sorted((name, entry["count"])
+                      for name, entry in self.entries.items()
+                      if term is None or term in name.lower())
+
+    def _offsets_file(self, name):
+        return os.path.join(self.offsets_path, name + ".json")
+
+
+class TriviaStats:
+    """Persistent trivia scores, per server and global
+
+    Records are updated in memory at the end of every question and
+    written to disk in batches by flush(). A sorted (-value, user id)
+    list is kept per scope and ranked metric so top N queries don't
+    need to sort the whole history."""
+
+    def __init__(self, path="data/trivia/stats.json"):
+        self.path = path
+        if dataIO.is_valid_json(path):
+            self.scopes = dataIO.load_json(path)  # "global"/sid: uid: record
+        else:
+            self.scopes = {}
+        self.dirty = False
+        self.rankings = {}  # (scope, metric): [(-value, uid), ...]
+        for scope, records in self.scopes.items():
+            for metric in RANKED_METRICS:
+                self.rankings[(scope, metric)] = sorted(
+                    (-r[metric], uid) for uid, r in records.items())
+
+    def record_question(self, server, guesses, winner=None, latency=None):
+        """guesses is a Counter of member: messages sent during the
+        question. The winner's latency is in seconds"""
+        for scope in ("global", server.id):
+            for user, count in guesses.items():
+                record = self._get_record(scope, user)
+                record["guesses"] += count
+            if winner is not None:
+                record = self._get_record(scope, winner)
+                self._update(scope, winner.id, record, "points",
+                             record["points"] + 1)
+                record["latency"] += latency
+        self.dirty = True
+
+    def record_win(self, server, user):
+        for scope in ("global", server.id):
+            record = self._get_record(scope, user)
+            self._update(scope, user.id, record, "wins", record["wins"] + 1)
+        self.dirty = True
+
+    def top(self, scope, metric="points", n=10):
+        """Returns up to n (user id, record) pairs"""
+        ranking = self.rankings.get((scope, metric), [])
+        records = self.scopes.get(scope, {})
+        return [(uid, records[uid]) for _, uid in ranking[:n]]
+
+    def flush(self):
+        if self.dirty:
+            self.dirty = False
+            dataIO.save_json(self.path, self.scopes)
+
+    def _get_record(self, scope, user):
+        records = self.scopes.setdefault(scope, {})
+        record = records.get(user.id)
+        if record is None:
+            record = {"name": user.name, "wins": 0, "points": 0,
+                      "guesses": 0, "latency": 0.0}
+            records[user.id] = record
+            for metric in RANKED_METRICS:
+                insort(self.rankings.setdefault((scope, metric), []),
+                       (0, user.id))
+        else:
+            record["name"] = user.name
+        return record
+
+    def _update(self, scope, uid, record, metric, value):
+        ranking = self.rankings[(scope, metric)]
+        del ranking[bisect_left(ranking, (-record[metric], uid))]
+        record[metric] = value
+        insort(ranking, (-value, uid))
 
 
 class Trivia:
     """General commands."""
     def __init__(self, bot):
         self.bot = bot
-        self.trivia_sessions = []
+        self.trivia_sessions = {}  # channel id: TriviaSession
+        self.list_cache = TriviaListCache()
+        self.catalog = TriviaCatalog()
+        self.stats = TriviaStats()
         self.file_path = "data/trivia/settings.json"
         settings = dataIO.load_json(self.file_path)
+        for server_settings in settings.values():
+            for k, v in DEFAULTS.items():
+                server_settings.setdefault(k, v)
         self.settings = defaultdict(lambda: DEFAULTS.copy(), settings)
 
     @commands.group(pass_context=True, no_pm=True)
@@ -39,6 +421,7 @@ class Trivia:
                       "Seconds to answer: {DELAY}\n"
                       "Points to win: {MAX_SCORE}\n"
                       "Reveal answer on timeout: {REVEAL_ANSWER}\n"
+                      "Fuzzy matching (max typos): {FUZZY}\n"
                       "".format(**settings))
             msg += "\nSee {}help triviaset to edit the settings".format(ctx.prefix)
             await self.bot.say(msg)
@@ -89,6 +472,23 @@ class Trivia:
             await self.bot.say("I'll reveal the answer if no one knows it.")
         self.save_settings()
 
+    @triviaset.command(pass_context=True)
+    async def fuzzy(self, ctx, max_typos : int):
+        """Accepts answers with a few typos. 0 to disable
+
+        Answers tolerate one typo every 4 characters, up to max_typos"""
+        server = ctx.message.server
+        if 0 <= max_typos <= 5:
+            self.settings[server.id]["FUZZY"] = max_typos
+            self.save_settings()
+            if max_typos:
+                await self.bot.say("Answers with up to {} typos will now "
+                                   "be accepted.".format(max_typos))
+            else:
+                await self.bot.say("Only exact answers will be accepted.")
+        else:
+            await self.bot.say("Max typos must be between 0 and 5.")
+
     @commands.group(pass_context=True, invoke_without_command=True, no_pm=True)
     async def trivia(self, ctx, list_name: str):
         """Start a trivia session with the specified list"""
@@ -97,7 +497,7 @@ class Trivia:
         session = self.get_trivia_by_channel(message.channel)
         if not session:
             try:
-                trivia_list = self.parse_trivia_list(list_name)
+                questions = await self.get_questions(list_name)
             except FileNotFoundError:
                 await self.bot.say("That trivia list doesn't exist.")
             except Exception as e:
@@ -105,9 +505,9 @@ class Trivia:
                 await self.bot.say("Error loading the trivia list.")
             else:
                 settings = self.settings[server.id]
-                t = TriviaSession(self.bot, trivia_list, message, settings)
-                self.trivia_sessions.append(t)
-                await t.new_question()
+                t = TriviaSession(self.bot, questions, message, settings)
+                self.trivia_sessions[message.channel.id] = t
+                await t.run()
         else:
             await self.bot.say("A trivia session is already ongoing in this channel.")
 
@@ -135,58 +535,104 @@ class Trivia:
             await self.bot.say("There's no trivia session ongoing in this channel.")
 
     @trivia.group(name="list")
-    async def trivia_list(self):
-        """Shows available trivia lists"""
-        lists = os.listdir("data/trivia/")
-        lists = [l for l in lists if l.endswith(".txt") and " " not in l]
-        lists = [l.replace(".txt", "") for l in lists]
+    async def trivia_list(self, *, search: str=None):
+        """Shows available trivia lists and their number of questions
+
+        Only lists containing search are shown if specified.
+        Lists marked with * are already loaded"""
+        lists = self.catalog.search(search)
 
         if lists:
-            msg = "+ Available trivia lists\n\n" + ", ".join(sorted(lists))
+            names = []
+            for name, count in lists:
+                if self.list_cache.is_warm(self.trivia_list_path(name)):
+                    name += "*"
+                names.append("{} ({})".format(name, count))
+            msg = "+ Available trivia lists\n\n" + ", ".join(names)
             msg = box(msg, lang="diff")
             if len(lists) < 100:
                 await self.bot.say(msg)
             else:
                 await self.bot.whisper(msg)
+        elif search:
+            await self.bot.say("No trivia list matches that search.")
         else:
             await self.bot.say("There are no trivia lists available.")
 
-    def parse_trivia_list(self, filename):
-        path = "data/trivia/{}.txt".format(filename)
-        parsed_list = []
-
-        with open(path, "rb") as f:
+    def trivia_list_path(self, filename):
+        return "data/trivia/{}.txt".format(filename)
+
+    async def get_trivia_list(self, filename):
+        """Returns the parsed list, parsing it in an executor
+        if it isn't cached or the file has changed"""
+        path = self.trivia_list_path(filename)
+        lines = self.list_cache.get(path)
+        if lines is None:
+            lines = await self.bot.loop.run_in_executor(
+                None, self.list_cache.load, path)
+        return lines
+
+    async def get_questions(self, filename):
+        """Returns an iterator of questions in random order
+
+        Large indexed lists are sampled from disk, the others are parsed
+        whole and cached"""
+        entry = self.catalog.entries.get(filename)
+        if entry and entry["count"] >= LARGE_LIST and \
+                self.catalog.is_current(filename):
+            offsets = await self.bot.loop.run_in_executor(
+                None, self.catalog.load_offsets, filename)
+            return read_trivia_lines(self.trivia_list_path(filename),
+                                     entry["encoding"], offsets)
+        lines = await self.get_trivia_list(filename)
+        return iter(sample(lines, len(lines)))
+
+    @trivia.command(name="leaderboard", pass_context=True, no_pm=True)
+    async def trivia_leaderboard(self, ctx, scope: str="server",
+                                 metric: str="points", top: int=10):
+        """Shows the best trivia players
+
+        scope: server or global
+        metric: points or wins"""
+        scope, metric = scope.lower(), metric.lower()
+        if scope not in ("server", "global") or metric not in RANKED_METRICS:
+            await send_cmd_help(ctx)
+            return
+        if top < 1:
+            top = 10
+        key = ctx.message.server.id if scope == "server" else "global"
+        ranking = self.stats.top(key, metric, top)
+        if not ranking:
+            await self.bot.say("Nobody has played trivia yet.")
+            return
+        lines = ["{:<4}{:<24}{:>7}{:>7}{:>10}{:>10}".format(
+            "#", "Name", "Points", "Wins", "Accuracy", "Latency")]
+        for place, (uid, r) in enumerate(ranking, 1):
+            accuracy = r["points"] / r["guesses"] if r["guesses"] else 0
+            latency = r["latency"] / r["points"] if r["points"] else 0
+            lines.append("{:<4}{:<24}{:>7}{:>7}{:>10.0%}{:>9.1f}s".format(
+                place, r["name"][:23], r["points"], r["wins"], accuracy,
+                latency))
+        for page in pagify("\n".join(lines), shorten_by=12):
+            await self.bot.say(box(page, lang="py"))
+
+    async def stats_flusher(self):
+        while self == self.bot.get_cog("Trivia"):
+            self.stats.flush()
+            await asyncio.sleep(STATS_FLUSH)
+        self.stats.flush()
+
+    async def catalog_refresher(self):
+        while self == self.bot.get_cog("Trivia"):
             try:
-                encoding = chardet.detect(f.read())["encoding"]
-            except:
-                encoding = "ISO-8859-1"
-
-        with open(path, "r", encoding=encoding) as f:
-            trivia_list = f.readlines()
-
-        for line in trivia_list:
-            if "`" not in line:
-                continue
-            line = line.replace("\n", "")
-            line = line.split("`")
-            question = line[0]
-            answers = []
-            for l in line[1:]:
-                answers.append(l.strip())
-            if len(line) >= 2 and question and answers:
-                line = TriviaLine(question=question, answers=answers)
-                parsed_list.append(line)
-
-        if not parsed_list:
-            raise ValueError("Empty trivia list")
-
-        return parsed_list
+                await self.bot.loop.run_in_executor(None,
+                                                    self.catalog.refresh)
+            except Exception as e:
+                log.exception(e)
+            await asyncio.sleep(CATALOG_REFRESH)
 
     def get_trivia_by_channel(self, channel):
-        for t in self.trivia_sessions:
-            if t.channel == channel:
-                return t
-        return None
+        return self.trivia_sessions.get(channel.id)
 
     async def on_message(self, message):
         if message.author != self.bot.user:
@@ -194,16 +640,32 @@ class Trivia:
             if session:
                 await session.check_answer(message)
 
+    async def on_trivia_question_end(self, instance):
+        guesses = Counter({user: count
+                           for user, count in instance.guesses.items()
+                           if user != self.bot.user})
+        winner = instance.winner
+        if winner == self.bot.user:
+            winner = None
+        if guesses or winner:
+            self.stats.record_question(instance.channel.server, guesses,
+                                       winner, instance.latency)
+
     async def on_trivia_end(self, instance):
-        if instance in self.trivia_sessions:
-            self.trivia_sessions.remove(instance)
+        if self.trivia_sessions.get(instance.channel.id) is instance:
+            del self.trivia_sessions[instance.channel.id]
+        if instance.has_winner():
+            user, _ = instance.scores.most_common(1)[0]
+            if user != self.bot.user:
+                self.stats.record_win(instance.channel.server, user)
 
     def save_settings(self):
         dataIO.save_json(self.file_path, self.settings)
 
 
 class TriviaSession():
-    def __init__(self, bot, trivia_list, message, settings):
+    def __init__(self, bot, questions, message, settings):
+        """questions is an iterable of TriviaLines, already in random order"""
         self.bot = bot
         self.reveal_messages = ("I know this one! {}!",
                                 "Easy: {}.",
@@ -213,7 +675,8 @@ class TriviaSession():
                               "I'm sure you'll know the answer of the next one.",
                               "\N{PENSIVE FACE} Next one.")
         self.current_line = None # {"QUESTION" : "String", "ANSWERS" : []}
-        self.question_list = trivia_list
+        self.matcher = None
+        self.questions = iter(questions)
         self.channel = message.channel
         self.starter = message.author
         self.scores = Counter()
@@ -222,66 +685,109 @@ class TriviaSession():
         self.timeout = time.perf_counter()
         self.count = 0
         self.settings = settings
+        self.answered = asyncio.Event()
+        self.guesses = Counter()  # member: messages sent this question
+        self.winner = None
+        self.latency = None
+        self.stopped = asyncio.Event()
 
     async def stop_trivia(self):
         self.status = "stop"
+        self.answered.set()
+        self.stopped.set()
         self.bot.dispatch("trivia_end", self)
 
     async def end_game(self):
         self.status = "stop"
+        self.answered.set()
+        self.stopped.set()
         if self.scores:
             await self.send_table()
         self.bot.dispatch("trivia_end", self)
 
-    async def new_question(self):
-        for score in self.scores.values():
-            if score == self.settings["MAX_SCORE"]:
+    async def run(self):
+        """Game loop. Asks questions until someone wins, the list runs
+        out, nobody talks for TIMEOUT seconds or the session is stopped"""
+        while self.status != "stop":
+            line = None if self.has_winner() else next(self.questions, None)
+            if line is None:
                 await self.end_game()
-                return True
-        if self.question_list == []:
-            await self.end_game()
-            return True
-        self.current_line = choice(self.question_list)
-        self.question_list.remove(self.current_line)
-        self.status = "waiting for answer"
+                return
+            answered = await self.new_question(line)
+            if self.status == "stop":
+                return
+            if not answered:
+                if self.idle_time() >= self.settings["TIMEOUT"]:
+                    await self.bot.send_message(self.channel, "Guys...? Well,"
+                                                " I guess I'll stop then.")
+                    await self.stop_trivia()
+                    return
+                await self.reveal_answer()
+            await self.pause(3)
+
+    async def new_question(self, line):
+        """Asks a question and waits for the answer, the time limit or
+        inactivity, whichever comes first
+
+        Returns True if someone answered correctly"""
+        self.current_line = line
+        max_edits = self.settings["FUZZY"]
+        self.matcher = FuzzyMatcher(line, max_edits) if max_edits else None
         self.count += 1
-        self.timer = int(time.perf_counter())
+        self.answered.clear()
+        self.guesses = Counter()
+        self.winner = None
+        self.latency = None
+        self.status = "waiting for answer"
         msg = "**Question number {}!**\n\n{}".format(self.count, self.current_line.question)
-        await self.bot.say(msg)
-
-        while self.status != "correct answer" and abs(self.timer - int(time.perf_counter())) <= self.settings["DELAY"]:
-            if abs(self.timeout - int(time.perf_counter())) >= self.settings["TIMEOUT"]:
-                await self.bot.say("Guys...? Well, I guess I'll stop then.")
-                await self.stop_trivia()
-                return True
-            await asyncio.sleep(1) #Waiting for an answer or for the time limit
-        if self.status == "correct answer":
-            self.status = "new question"
-            await asyncio.sleep(3)
-            if not self.status == "stop":
-                await self.new_question()
-        elif self.status == "stop":
-            return True
+        self.timer = time.perf_counter()
+        await self.bot.send_message(self.channel, msg)
+        deadline = time.perf_counter() + self.settings["DELAY"]
+
+        while not self.answered.is_set():
+            # self.timeout moves forward with every message in the channel
+            idle_deadline = self.timeout + self.settings["TIMEOUT"]
+            remaining = min(deadline, idle_deadline) - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self.answered.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        self.bot.dispatch("trivia_question_end", self)
+        return self.status == "correct answer"
+
+    async def reveal_answer(self):
+        if self.settings["REVEAL_ANSWER"]:
+            msg = choice(self.reveal_messages).format(self.current_line.answers[0])
         else:
-            if self.settings["REVEAL_ANSWER"]:
-                msg = choice(self.reveal_messages).format(self.current_line.answers[0])
-            else:
-                msg = choice(self.fail_messages)
-            if self.settings["BOT_PLAYS"]:
-                msg += " **+1** for me!"
-                self.scores[self.bot.user] += 1
-            self.current_line = None
-            await self.bot.say(msg)
-            await self.bot.type()
-            await asyncio.sleep(3)
-            if not self.status == "stop":
-                await self.new_question()
+            msg = choice(self.fail_messages)
+        if self.settings["BOT_PLAYS"]:
+            msg += " **+1** for me!"
+            self.scores[self.bot.user] += 1
+        self.current_line = None
+        await self.bot.send_message(self.channel, msg)
+        await self.bot.send_typing(self.channel)
+
+    async def pause(self, seconds):
+        """Sleeps between questions, returns early if stopped"""
+        try:
+            await asyncio.wait_for(self.stopped.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def has_winner(self):
+        return any(score >= self.settings["MAX_SCORE"]
+                   for score in self.scores.values())
+
+    def idle_time(self):
+        return time.perf_counter() - self.timeout
 
     async def send_table(self):
         t = "+ Results: \n\n"
         for user, score in self.scores.most_common():
             t += "+ {}\t{}\n".format(user, score)
-        await self.bot.say(box(t, lang="diff"))
+        await self.bot.send_message(self.channel, box(t, lang="diff"))
 
     async def check_answer(self, message):
         if message.author == self.bot.user:
@@ -290,30 +796,30 @@ class TriviaSession():
             return
 
         self.timeout = time.perf_counter()
-        has_guessed = False
-
-        for answer in self.current_line.answers:
-            answer = answer.lower()
-            guess = message.content.lower()
-            if " " not in answer:  # Exact matching, issue #331
-                guess = guess.split(" ")
-                for word in guess:
-                    if word == answer:
-                        has_guessed = True
-            else:  # The answer has spaces, we can't be as strict
-                if answer in guess:
-                    has_guessed = True
+        self.guesses[message.author] += 1
+        line = self.current_line
+        guess = message.content.lower()
+        tokens = guess.split()
+
+        has_guessed = not line.words.isdisjoint(tokens)
+        if not has_guessed:
+            has_guessed = any(phrase in guess for phrase in line.phrases)
+        if not has_guessed and self.matcher is not None:
+            has_guessed = self.matcher.matches(tokens)
 
         if has_guessed:
             self.current_line = None
             self.status = "correct answer"
             self.scores[message.author] += 1
+            self.winner = message.author
+            self.latency = time.perf_counter() - self.timer
             msg = "You got it {}! **+1** to you!".format(message.author.name)
             await self.bot.send_message(message.channel, msg)
+            self.answered.set()
 
 
 def check_folders():
-    folders = ("data", "data/trivia/")
+    folders = ("data", "data/trivia/", "data/trivia/index/")
     for folder in folders:
         if not os.path.exists(folder):
             print("Creating " + folder + " folder...")
@@ -329,4 +835,7 @@ def check_files():
 def setup(bot):
     check_folders()
     check_files()
-    bot.add_cog(Trivia(bot))
+    n = Trivia(bot)
+    bot.add_cog(n)
+    bot.loop.create_task(n.catalog_refresher())
+    bot.loop.create_task(n.stats_flusher())
@@ -0,0 +1,121 @@
+import re
+
+PLACEHOLDER = re.compile(r"\{(\d+|args)\}")
+COMMAND = object()  # Trie marker for real bot commands
+ARGS = object()  # Template part for {args}
+
+
+class AliasCycle(Exception):
+    pass
+
+
+class AliasTemplate:
+    """What an alias expands to, split once into literal text and
+    argument placeholders
+
+    {0}, {1}... are replaced by the alias' arguments and {args} by all
+    of them. Without placeholders the arguments are appended at the end"""
+
+    def __init__(self, text):
+        self.text = text
+        self.parts = []
+        last = 0
+        for match in PLACEHOLDER.finditer(text):
+            self.parts.append(text[last:match.start()])
+            key = match.group(1)
+            self.parts.append(ARGS if key == "args" else int(key))
+            last = match.end()
+        self.parts.append(text[last:])
+        self.has_placeholders = len(self.parts) > 1
+
+    def render(self, args):
+        if not self.has_placeholders:
+            return " ".join([self.text] + args) if args else self.text
+        out = []
+        for part in self.parts:
+            if part is ARGS:
+                out.append(" ".join(args))
+            elif isinstance(part, str):
+                out.append(part)
+            elif part < len(args):
+                out.append(args[part])
+        return "".join(out)
+
+
+class AliasChain:
+    """An alias followed through the aliases it starts with
+
+    Each hop renders the previous hop's output, minus the words naming
+    the next alias. Those words are literal text in the template, so the
+    hops are known when the trie is built and dispatching never walks it
+    again, while every placeholder still gets the caller's arguments"""
+
+    def __init__(self, hops):
+        self.hops = hops  # [(words naming the template, template)]
+        self.text = hops[-1][1].text
+
+    def render(self, args):
+        text = self.hops[0][1].render(args)
+        for length, template in self.hops[1:]:
+            text = template.render(text.split(" ")[length:])
+        return text
+
+
+class AliasTrie:
+    """Token trie over a server's aliases and the bot's commands
+
+    Alias chains are resolved when the trie is built, so a message is
+    matched with a single walk over its words"""
+
+    def __init__(self, aliases, command_names):
+        self.root = {}
+        self.command_count = len(command_names)
+        for name in command_names:
+            self._insert(name.lower().split(" "), COMMAND)
+        for alias, text in aliases.items():
+            self._insert(alias.split(" "), AliasTemplate(text))
+        self.flattened = {}
+        for alias, text in aliases.items():
+            self.flattened[alias] = self.expand_chain(alias, text)
+        for alias, chain in self.flattened.items():
+            self._insert(alias.split(" "), chain)
+
+    def longest_match(self, tokens):
+        """Returns (number of tokens, value) of the longest alias or
+        command the tokens start with, (0, None) if there's none"""
+        node = self.root
+        best = (0, None)
+        for i, token in enumerate(tokens, 1):
+            node = node.get(token.lower())
+            if node is None:
+                break
+            if None in node:
+                best = (i, node[None])
+        return best
+
+    def expand_chain(self, alias, text):
+        """Follows alias to alias references until the expansion starts
+        with something that isn't an alias, returns an AliasChain
+
+        Raises AliasCycle if an alias ends up referencing itself"""
+        template = AliasTemplate(text)
+        hops = [(0, template)]
+        seen = {alias}
+        while True:
+            tokens = template.text.split(" ")
+            length, value = self.longest_match(tokens)
+            if not isinstance(value, AliasTemplate) or \
+                    any(PLACEHOLDER.search(t) for t in tokens[:length]):
+                return AliasChain(hops)
+            name = " ".join(tokens[:length]).lower()
+            if name in seen:
+                raise AliasCycle(name)
+            seen.add(name)
+            template = value
+            hops.append((length, template))
+
+    def _insert(self, tokens, value):
+        node = self.root
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node[None] = value
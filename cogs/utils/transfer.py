@@ -0,0 +1,57 @@
+import aiohttp
+import csv
+import json
+
+CHUNK_SIZE = 64 * 1024
+
+
+def attachment_format(message):
+    """Guesses csv or jsonl from the message's first attachment"""
+    if message.attachments:
+        filename = message.attachments[0].get("filename", "")
+        if filename.lower().endswith(".jsonl"):
+            return "jsonl"
+    return "csv"
+
+
+async def fetch_attachment(message, path):
+    """Streams the message's first attachment to path
+
+    Returns False if the message has no attachment"""
+    if not message.attachments:
+        return False
+    url = message.attachments[0]["url"]
+    async with aiohttp.get(url) as r:
+        with open(path, "wb") as f:
+            while True:
+                chunk = await r.content.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+    return True
+
+
+def row_writer(fp, fields, fmt):
+    """Returns a function that writes one row (a tuple ordered as fields)
+
+    csv files get a header line first. Raises ValueError on unknown fmt"""
+    if fmt == "csv":
+        writer = csv.writer(fp)
+        writer.writerow(fields)
+        return writer.writerow
+    elif fmt == "jsonl":
+        def write(row):
+            fp.write(json.dumps(dict(zip(fields, row))) + "\n")
+        return write
+    raise ValueError(fmt)
+
+
+def read_rows(fp, fmt):
+    """Lazily yields each row of fp as a dict
+
+    Raises ValueError on unknown fmt"""
+    if fmt == "csv":
+        return csv.DictReader(fp)
+    elif fmt == "jsonl":
+        return (json.loads(line) for line in fp if line.strip())
+    raise ValueError(fmt)
@@ -0,0 +1,505 @@
+"""Song resolution, downloads and the audio cache's file layout
+
+Kept apart from the Audio cog so worker processes can unpickle jobs
+without importing discord or __main__ from here. Spawned and forkserver
+workers still import red.py as __mp_main__, which loads its module
+level imports but doesn't start a bot."""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from cogs.utils.dataIO import dataIO
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import subprocess
+import sys
+import time
+
+log = logging.getLogger("red.audio")
+
+try:
+    import youtube_dl
+except:
+    youtube_dl = None
+
+DOWNLOAD_WORKERS = 4
+
+youtube_dl_options = {
+    'source_address': '0.0.0.0',
+    'format': 'bestaudio/best',
+    'extractaudio': True,
+    'audioformat': "mp3",
+    'nocheckcertificate': True,
+    'ignoreerrors': False,
+    'quiet': True,
+    'no_warnings': True,
+    'outtmpl': "data/audio/cache/.tmp/%(id)s",
+    'default_search': 'auto',
+    'encoding': 'utf-8'
+}
+
+
+class MaximumLength(Exception):
+    def __init__(self, m):
+        self.message = m
+
+    def __str__(self):
+        return self.message
+    
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+class IncompleteDownload(Exception):
+    pass
+
+
+class Song:
+    def __init__(self, **kwargs):
+        self.__dict__ = kwargs
+        self.title = kwargs.pop('title', None)
+        self.id = kwargs.pop('id', None)
+        self.url = kwargs.pop('url', None)
+        self.webpage_url = kwargs.pop('webpage_url', "")
+        self.duration = kwargs.pop('duration', 60)
+        self.start_time = kwargs.pop('start_time', None)
+        self.end_time = kwargs.pop('end_time', None)
+
+
+class CacheStore:
+    """File layout of the audio cache
+
+    <id>        the downloaded audio
+    <id>.json   sidecar record: source, duration, codec, size, last played
+    <id>.opus   optional pre-transcoded variant
+    .tmp/<id>   downloads in progress, renamed into place once verified
+
+    A file only counts as cached when its sidecar agrees on its size, so
+    a crash mid-write never leaves something that looks playable."""
+
+    def __init__(self, path, opus=False, encoder="ffmpeg"):
+        self.path = path
+        self.temp_path = os.path.join(path, ".tmp")
+        self.opus = opus
+        self.encoder = encoder
+
+    def audio_path(self, song_id):
+        return os.path.join(self.path, song_id)
+
+    def sidecar_path(self, song_id):
+        return os.path.join(self.path, song_id + ".json")
+
+    def opus_path(self, song_id):
+        return os.path.join(self.path, song_id + ".opus")
+
+    def temp_file(self, song_id):
+        return os.path.join(self.temp_path, song_id)
+
+    def play_path(self, song_id):
+        """The cheapest file to hand to the player"""
+        opus_path = self.opus_path(song_id)
+        if os.path.isfile(opus_path):
+            return opus_path
+        return self.audio_path(song_id)
+
+    @staticmethod
+    def is_sidecar_file(name):
+        return name.startswith(".") or \
+            name.endswith((".json", ".opus", ".part", ".ytdl", ".tmp"))
+
+    def read_sidecar(self, song_id):
+        path = self.sidecar_path(song_id)
+        if not dataIO.is_valid_json(path):
+            return None
+        return dataIO.load_json(path)
+
+    def write_sidecar(self, song_id, record):
+        dataIO.save_json(self.sidecar_path(song_id), record)
+
+    def is_complete(self, song_id):
+        try:
+            size = os.path.getsize(self.audio_path(song_id))
+        except OSError:
+            return False
+        record = self.read_sidecar(song_id)
+        if record is None:
+            # Cached before sidecars existed, youtube_dl renames its own
+            #   .part files so whatever is there is whole
+            record = {"source": None, "size": size, "last_played": None}
+            self.write_sidecar(song_id, record)
+        return record.get("size") == size
+
+    def commit(self, song_id, info):
+        """Verifies a finished download in the temp folder and moves it
+        into the cache along with its sidecar"""
+        temp = self.temp_file(song_id)
+        size = os.path.getsize(temp)
+        expected = info.get("filesize")
+        if size == 0 or (expected and size < expected):
+            os.remove(temp)
+            raise IncompleteDownload("{} is {} bytes, expected {}".format(
+                song_id, size, expected))
+        os.replace(temp, self.audio_path(song_id))
+        record = {"source": info.get("webpage_url"),
+                  "title": info.get("title"),
+                  "duration": info.get("duration"),
+                  "codec": info.get("acodec"),
+                  "ext": info.get("ext"),
+                  "size": size,
+                  "downloaded": time.time(),
+                  "last_played": None}
+        if self.opus and record["codec"] != "opus":
+            record["opus"] = self.transcode(song_id)
+        self.write_sidecar(song_id, record)
+        return record
+
+    def transcode(self, song_id):
+        """Keeps an Opus copy next to the download, returns its size or
+        None if the encoder failed"""
+        temp = self.temp_file(song_id + ".opus")
+        args = [self.encoder, "-y", "-loglevel", "error",
+                "-i", self.audio_path(song_id), "-vn",
+                "-c:a", "libopus", "-b:a", "96k", "-f", "ogg", temp]
+        try:
+            subprocess.check_call(args, stdin=subprocess.DEVNULL,
+                                  stdout=subprocess.DEVNULL)
+        except (OSError, subprocess.CalledProcessError) as e:
+            log.warning("couldn't transcode {} to opus: {}".format(song_id, e))
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            return None
+        os.replace(temp, self.opus_path(song_id))
+        return os.path.getsize(self.opus_path(song_id))
+
+    def mark_played(self, song_id):
+        record = self.read_sidecar(song_id)
+        if record is not None:
+            record["last_played"] = time.time()
+            self.write_sidecar(song_id, record)
+
+    def size_on_disk(self, song_id):
+        size = 0
+        for path in (self.audio_path(song_id), self.opus_path(song_id)):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def remove(self, song_id):
+        """Deletes a song and its variants. Raises OSError if the audio
+        file is in use"""
+        try:
+            os.remove(self.audio_path(song_id))
+        except FileNotFoundError:
+            pass
+        for path in (self.opus_path(song_id), self.sidecar_path(song_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear_temp(self):
+        for entry in os.scandir(self.temp_path):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+class YoutubeDLPool:
+    """Reuses YoutubeDL instances instead of building one per lookup"""
+
+    def __init__(self, options, size=DOWNLOAD_WORKERS):
+        self.options = options
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    @contextmanager
+    def get(self, progress_hook=None):
+        try:
+            yt = self.idle.get_nowait()
+        except queue.Empty:
+            yt = youtube_dl.YoutubeDL(self.options)
+        # Progress hooks belong to the job, not to the instance
+        yt._progress_hooks = [progress_hook] if progress_hook else []
+        try:
+            yield yt
+        finally:
+            yt._progress_hooks = []
+            try:
+                self.idle.put_nowait(yt)
+            except queue.Full:
+                pass
+
+
+class Downloader:
+    """Resolves a URL, and optionally downloads it, on a worker pool
+
+    start() submits the job to an executor and returns an awaitable
+    future. cancel() drops the job if it hasn't started yet and aborts
+    a running download at its next progress update.
+
+    Given a ProcessPoolExecutor the job runs through run_job in a worker
+    process instead, and its result is copied back before the future
+    completes. A job already running in a process can't be aborted, its
+    result is just dropped. If the worker dies, error is set and
+    broken_pool holds the executor so the owner can replace it."""
+
+    def __init__(self, url, max_duration=None, download=False,
+                 cache_path="data/audio/cache", stream=False):
+        self.url = url
+        self.requested_url = url  # url gets rewritten for searches
+        self.max_duration = max_duration
+        self.song = None
+        self._download = download
+        self._stream = stream
+        self.stream_url = None
+        self.hit_max_length = False
+        self.error = None
+        self.future = None
+        self.cancelled = False
+        self.cache_path = cache_path
+        self.metadata = None
+        self.ytdl_pool = None
+        self.store = None
+        self.cached_info = None
+        self.broken_pool = None
+        self.job = None  # The Downloader a follower waits on
+        self.followers = 0
+
+    def start(self, loop, executor, metadata=None, ytdl_pool=None,
+              store=None):
+        """Submits the job, does nothing if it was already started"""
+        if self.future is None:
+            self.metadata = metadata
+            self.ytdl_pool = ytdl_pool
+            self.store = store or CacheStore(self.cache_path)
+            if isinstance(executor, ProcessPoolExecutor):
+                self.future = asyncio.ensure_future(
+                    self._run_in_process(loop, executor), loop=loop)
+            else:
+                self.future = loop.run_in_executor(executor, self.run)
+        return self.future
+
+    async def _run_in_process(self, loop, executor):
+        cached = None
+        if self.metadata is not None:
+            cached = self.metadata.get(self.url)
+        try:
+            result = await loop.run_in_executor(
+                executor, run_job, self.url, self.max_duration,
+                self._download, self._stream, self.store.path,
+                self.store.opus, self.store.encoder, cached)
+        except asyncio.CancelledError:
+            raise
+        except BrokenProcessPool:
+            log.warning("a worker process died while fetching {}".format(
+                self.url))
+            self.broken_pool = executor
+            self.error = "The worker process handling this song died."
+            return
+        except Exception as e:  # Pickling errors, a worker that can't start
+            log.exception("worker process job for {} failed".format(self.url))
+            self.error = str(e)
+            return
+        self.url = result["url"]
+        self.stream_url = result["stream_url"]
+        self.error = result["error"]
+        self.hit_max_length = result["hit_max_length"]
+        if result["song"] is not None:
+            self.song = Song(**result["song"])
+            if self.metadata is not None and \
+                    (cached is None or self._download):
+                self.metadata.put(self.requested_url, result["song"])
+
+    def follow(self, loop):
+        """A Downloader that waits on this job instead of running its own
+
+        Cancelling a follower only stops it from waiting, the job itself
+        is cancelled once every follower was"""
+        follower = Downloader(self.requested_url, self.max_duration,
+                              self._download, self.cache_path, self._stream)
+        follower.job = self
+        follower.future = asyncio.ensure_future(follower._follow(),
+                                                loop=loop)
+        self.followers += 1
+        return follower
+
+    async def _follow(self):
+        try:
+            await asyncio.shield(self.job.future)
+        except asyncio.CancelledError:
+            if self.cancelled:
+                raise
+            self.cancelled = True  # The job itself was cancelled
+            return
+        self.url = self.job.url
+        self.song = self.job.song
+        self.stream_url = self.job.stream_url
+        self.error = self.job.error
+        self.hit_max_length = self.job.hit_max_length
+        self.cancelled = self.job.cancelled
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+        if self.job is not None:
+            self.job.followers -= 1
+            if self.job.followers <= 0:
+                self.job.cancel()
+
+    def is_alive(self):
+        return self.future is not None and not self.future.done()
+
+    async def wait(self):
+        """Waits for the job to finish. Returns early if it's cancelled"""
+        try:
+            await asyncio.shield(self.future)
+        except asyncio.CancelledError:
+            if not self.cancelled:
+                raise
+
+    def run(self):
+        if self.cancelled:
+            return
+        try:
+            self.get_info()
+            if self._stream:
+                self.resolve_stream()
+            elif self._download:
+                self.download()
+        except youtube_dl.utils.DownloadError as e:
+            self.error = str(e)
+        except MaximumLength:
+            self.hit_max_length = True
+        except IncompleteDownload as e:
+            self.error = str(e)
+        except DownloadCancelled:
+            log.debug("download of {} cancelled".format(self.url))
+        except OSError as e:
+            log.warning("An operating system error occurred while downloading URL '{}':\n'{}'".format(self.url, str(e)))
+        except Exception as e:  # Empty search results, odd metadata...
+            log.exception("unexpected error fetching {}".format(self.url))
+            self.error = str(e)
+
+    def _progress_hook(self, status):
+        if self.cancelled:
+            raise DownloadCancelled()
+
+    def download(self):
+        self.duration_check()
+
+        if not self.store.is_complete(self.song.id):
+            with self._youtube_dl() as yt:
+                video = yt.extract_info(self.url)
+            self.store.commit(video["id"], video)
+            self.song = Song(**video)
+            if self.metadata is not None:
+                self.metadata.put(self.url, video)
+
+    def resolve_stream(self):
+        """Picks the media URL ffmpeg can read from directly"""
+        self.duration_check()
+        with self._youtube_dl() as yt:
+            video = yt.extract_info(self.url, download=False)
+        self.stream_url = video.get("url")
+        if self.stream_url is None:
+            raise youtube_dl.utils.DownloadError(
+                "No streamable format for {}".format(self.url))
+        self.song = Song(**video)
+
+    def duration_check(self):
+        log.debug("duration {} for songid {}".format(self.song.duration,
+                                                     self.song.id))
+        if self.max_duration and self.song.duration > self.max_duration:
+            log.debug("songid {} too long".format(self.song.id))
+            raise MaximumLength("songid {} has duration {} > {}".format(
+                self.song.id, self.song.duration, self.max_duration))
+
+    def _youtube_dl(self):
+        if self.ytdl_pool is None:
+            self.ytdl_pool = YoutubeDLPool(youtube_dl_options)
+        return self.ytdl_pool.get(self._progress_hook)
+
+    def get_info(self):
+        requested = self.url
+        video = self.cached_info
+        if video is None and self.metadata is not None:
+            video = self.metadata.get(requested)
+        if video is not None and "[SEARCH:]" in requested:
+            if video.get("webpage_url"):
+                self.url = video["webpage_url"]
+            else:
+                video = None
+        if video is None:
+            video = self._extract_info()
+            if self.metadata is not None:
+                self.metadata.put(requested, video)
+
+        if(video is not None):
+            self.song = Song(**video)
+
+    def _extract_info(self):
+        with self._youtube_dl() as yt:
+            if "[SEARCH:]" not in self.url:
+                return yt.extract_info(self.url, download=False,
+                                       process=False)
+            self.url = self.url[9:]
+            yt_id = yt.extract_info(
+                self.url, download=False)["entries"][0]["id"]
+            # Should handle errors here ^
+            self.url = "https://youtube.com/watch?v={}".format(yt_id)
+            return yt.extract_info(self.url, download=False, process=False)
+
+
+_worker_ytdl_pool = None
+
+
+def run_job(url, max_duration, download, stream, cache_path, opus, encoder,
+            cached_info):
+    """Runs a Downloader inside a worker process. Takes and returns only
+    plain data so it can cross the process boundary"""
+    global _worker_ytdl_pool
+    if _worker_ytdl_pool is None:
+        _worker_ytdl_pool = YoutubeDLPool(youtube_dl_options, size=1)
+
+    job = Downloader(url, max_duration, download, cache_path, stream)
+    job.store = CacheStore(cache_path, opus, encoder)
+    job.ytdl_pool = _worker_ytdl_pool
+    job.cached_info = cached_info
+    job.run()
+
+    song = None
+    if job.song is not None:
+        song = dict(job.song.__dict__)
+        if song.get("entries") is not None:
+            song["entries"] = list(song["entries"])  # Often a generator
+    return {"url": job.url, "song": song, "stream_url": job.stream_url,
+            "error": job.error, "hit_max_length": job.hit_max_length}
+
+
+def make_process_pool(processes):
+    """A ProcessPoolExecutor whose workers are started with forkserver, or
+    spawn where that isn't available. Forking would copy the whole bot
+    into every worker, event loop and sockets included.
+
+    Before Python 3.7 the start method can't be chosen per pool, so
+    None is returned unless spawn already is the default (Windows)"""
+    methods = multiprocessing.get_all_start_methods()
+    method = "forkserver" if "forkserver" in methods else "spawn"
+    if sys.version_info >= (3, 7):
+        return ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context(method))
+    if multiprocessing.get_start_method() == "spawn":
+        return ProcessPoolExecutor(max_workers=processes)
+    return None
@@ -0,0 +1,47 @@
+import pytest
+
+from cogs.utils.alias_trie import AliasCycle, AliasTemplate, AliasTrie
+
+
+def resolve(trie, content):
+    tokens = content.split(" ")
+    length, chain = trie.longest_match(tokens)
+    return chain.render(tokens[length:])
+
+
+def test_args_placeholder():
+    assert AliasTemplate("say {args}").render(["hi", "there"]) == \
+        "say hi there"
+
+
+def test_indexed_placeholders():
+    template = AliasTemplate("ban {0} reason {1}")
+    assert template.render(["x", "y"]) == "ban x reason y"
+
+
+def test_no_placeholders_appends_args():
+    assert AliasTemplate("flip").render(["@me"]) == "flip @me"
+
+
+def test_chain_keeps_placeholders():
+    trie = AliasTrie({"b": "ban {0} reason {1}", "a": "b"}, ["ban"])
+    assert resolve(trie, "a x y") == "ban x reason y"
+    assert trie.flattened["a"].text == "ban {0} reason {1}"
+
+
+def test_chain_through_placeholders():
+    trie = AliasTrie({"b": "ban {1} reason {0}", "a": "b {0} spam",
+                      "c d": "a {args}"}, ["ban"])
+    assert resolve(trie, "a x") == "ban spam reason x"
+    assert resolve(trie, "c d x") == "ban spam reason x"
+
+
+def test_chain_multi_word_alias():
+    trie = AliasTrie({"coin toss": "flip {0}", "toss": "coin toss {args}"},
+                     ["flip"])
+    assert resolve(trie, "toss @me") == "flip @me"
+
+
+def test_cycle():
+    with pytest.raises(AliasCycle):
+        AliasTrie({"a": "b", "b": "a"}, [])